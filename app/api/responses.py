@@ -0,0 +1,89 @@
+from typing import Any, Dict, List, Optional
+
+import orjson
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.requests import ClientDisconnect
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.services.timing import phase
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize to JSON with orjson, falling back to str() for unknown types"""
+    return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _field_tree(fields: str) -> Dict[str, Any]:
+    """Turn "a,b.c,b.d" into {"a": {}, "b": {"c": {}, "d": {}}}"""
+    tree: Dict[str, Any] = {}
+    for field in fields.split(","):
+        node = tree
+        for part in field.strip().split("."):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def _project(value: Any, tree: Dict[str, Any]) -> Any:
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [_project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: _project(value[key], subtree) for key, subtree in tree.items() if key in value}
+    return value
+
+
+def project(content: Any, fields: Optional[str]) -> Any:
+    """
+    Keep only the requested fields of a response
+
+    Fields are comma-separated, nested fields are given as parent.child and
+    apply to every item of a list, e.g. "count,results.domain".
+    """
+    if not fields:
+        return content
+    return _project(content, _field_tree(fields))
+
+
+def json_response(content: Any, response: Optional[Response] = None, fields: Optional[str] = None) -> FastJSONResponse:
+    """
+    Render an endpoint result directly, skipping response model validation
+
+    Headers set on the endpoint's injected `response` are carried over, as
+    FastAPI does not merge them into responses returned by the endpoint.
+    """
+    with phase("serialize"):
+        rendered = FastJSONResponse(project(content, fields))
+    if response is not None:
+        for name, value in response.headers.items():
+            rendered.headers[name] = value
+    return rendered
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    Streaming response whose body iterator keeps reading the request body
+
+    StreamingResponse listens for client disconnects by consuming receive(),
+    which would steal the request body chunks from the body iterator. Here the
+    iterator owns receive() (request.stream() raises ClientDisconnect on its
+    own) and failed sends are reported the same way.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+
+        if self.background is not None:
+            await self.background()
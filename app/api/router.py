@@ -1,28 +1,61 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from typing import Dict, Any, List, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
 from loguru import logger
+import base64
+import binascii
+import os
 
 from app.models.api_key import ApiKey, ApiKeyCreate
+from app.models.dns import DNSBatchRequest
+from app.api.responses import DuplexStreamingResponse, FastJSONResponse, dumps, json_response
 from app.middleware.auth import get_api_key, get_admin_secret
 from app.middleware.rate_limit import rate_limit_middleware
-from app.middleware.logger import log_dns_query, log_whois_query
+from app.middleware.logger import log_dns_query, log_dns_batch, log_dns_stream, log_dns_message, log_domain_profile, log_whois_query
 from app.services.dns_service import DNSService
+from app.services.domain_profile import DEFAULT_PROFILE_TYPES, DomainProfileService, parse_record_types
 from app.services.whois_service import WhoisService
 from app.services.api_key_service import ApiKeyService
+from app.services.api_key_cache import api_key_cache
+from app.services.log_pipeline import log_pipeline
+from app.services.profiler import ProfilerBusy, SamplingProfiler, collapsed_stacks
+from app.services.timing import phase, slow_requests
 
 router = APIRouter()
 
 # Initialize services
 dns_service = DNSService()
 whois_service = WhoisService()
+domain_profile_service = DomainProfileService(dns_service, whois_service)
 api_key_service = ApiKeyService()
+profiler = SamplingProfiler()
 
+# Maximum number of items accepted in a single DNS batch
+DNS_BATCH_MAX_ITEMS = int(os.getenv("DNS_BATCH_MAX_ITEMS", 1000))
 
-@router.get("/dns/lookup", response_model=Dict[str, Any])
+# Names of a DNS stream are charged against the rate limit in blocks of this size
+DNS_STREAM_CHARGE_BLOCK = int(os.getenv("DNS_STREAM_CHARGE_BLOCK", 100))
+
+# Longest accepted line in a DNS stream body
+DNS_STREAM_MAX_LINE = 1024
+
+# Help text of the `fields` projection parameter of JSON endpoints
+FIELDS_DESCRIPTION = "Comma-separated fields to return, nested fields as parent.child"
+
+# Media type of DNS messages in wire format (RFC 8484)
+DNS_MESSAGE_MEDIA_TYPE = "application/dns-message"
+
+# Largest possible DNS message
+DNS_MESSAGE_MAX_SIZE = 65535
+
+
+@router.get("/dns/lookup", response_class=FastJSONResponse)
 async def dns_lookup(
+    response: Response,
     domain: str = Query(..., description="Domain to lookup"),
     record_type: str = Query("A", description="DNS record type (A, AAAA, MX, TXT, etc.)"),
     dnssec: bool = Query(False, description="Whether to perform DNSSEC validation"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
     api_key_info: Tuple[str, ApiKey] = Depends(get_api_key)
 ):
     """
@@ -31,21 +64,24 @@ async def dns_lookup(
     api_key, api_key_obj = api_key_info
     
     # Apply rate limiting
-    await rate_limit_middleware(None, api_key, api_key_obj)
+    await rate_limit_middleware(response, api_key, api_key_obj)
     
     # Perform DNS lookup
     result = await dns_service.lookup(domain, record_type, dnssec)
     
     # Log the query
-    await log_dns_query(api_key, api_key_obj.name, "lookup", domain, result)
+    with phase("log"):
+        await log_dns_query(api_key, api_key_obj.name, "lookup", domain, result)
     
-    return result
+    return json_response(result, response, fields)
 
 
-@router.get("/dns/reverse", response_model=Dict[str, Any])
+@router.get("/dns/reverse", response_class=FastJSONResponse)
 async def reverse_dns_lookup(
+    response: Response,
     ip: str = Query(..., description="IP address to lookup"),
     dnssec: bool = Query(False, description="Whether to perform DNSSEC validation"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
     api_key_info: Tuple[str, ApiKey] = Depends(get_api_key)
 ):
     """
@@ -54,21 +90,24 @@ async def reverse_dns_lookup(
     api_key, api_key_obj = api_key_info
     
     # Apply rate limiting
-    await rate_limit_middleware(None, api_key, api_key_obj)
+    await rate_limit_middleware(response, api_key, api_key_obj)
     
     # Perform reverse DNS lookup
     result = await dns_service.reverse_lookup(ip, dnssec)
     
     # Log the query
-    await log_dns_query(api_key, api_key_obj.name, "reverse_lookup", ip, result)
+    with phase("log"):
+        await log_dns_query(api_key, api_key_obj.name, "reverse_lookup", ip, result)
     
-    return result
+    return json_response(result, response, fields)
 
 
-@router.get("/dns/ptr", response_model=Dict[str, Any])
+@router.get("/dns/ptr", response_class=FastJSONResponse)
 async def resolve_ptr(
+    response: Response,
     ip: str = Query(..., description="IP address to resolve PTR record for"),
     dnssec: bool = Query(False, description="Whether to perform DNSSEC validation"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
     api_key_info: Tuple[str, ApiKey] = Depends(get_api_key)
 ):
     """
@@ -77,21 +116,193 @@ async def resolve_ptr(
     api_key, api_key_obj = api_key_info
     
     # Apply rate limiting
-    await rate_limit_middleware(None, api_key, api_key_obj)
+    await rate_limit_middleware(response, api_key, api_key_obj)
     
     # Resolve PTR record
     result = await dns_service.resolve_ptr(ip, dnssec)
     
     # Log the query
-    await log_dns_query(api_key, api_key_obj.name, "ptr", ip, result)
+    with phase("log"):
+        await log_dns_query(api_key, api_key_obj.name, "ptr", ip, result)
+    
+    return json_response(result, response, fields)
+
+
+@router.post("/dns/batch", response_class=FastJSONResponse)
+async def dns_batch(
+    batch: DNSBatchRequest,
+    response: Response,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    api_key_info: Tuple[str, ApiKey] = Depends(get_api_key)
+):
+    """
+    Perform a batch of DNS lookups and reverse lookups
+    Results are returned in the same order as the items
+    """
+    api_key, api_key_obj = api_key_info
+    
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one item")
+    
+    if len(batch.items) > DNS_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch too large. Maximum is {DNS_BATCH_MAX_ITEMS} items."
+        )
+    
+    # Apply rate limiting, each item counts as one request
+    await rate_limit_middleware(response, api_key, api_key_obj, cost=len(batch.items))
+    
+    # Perform the lookups
+    results = await dns_service.batch_lookup(batch.items)
+    
+    # Log the batch
+    with phase("log"):
+        await log_dns_batch(api_key, api_key_obj.name, results)
+    
+    return json_response({
+        "count": len(results),
+        "results": results
+    }, response, fields)
+
+
+async def _read_stream_queries(
+    request: Request,
+    record_type: str,
+    api_key: str,
+    api_key_obj: ApiKey
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Parse (domain, record_type) queries from a newline-delimited request body
+    as it arrives. Each line holds a domain and an optional record type.
+    """
+    buffer = b""
+    uncharged = 0
+    
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > DNS_STREAM_MAX_LINE:
+            raise ValueError(f"Line too long. Maximum is {DNS_STREAM_MAX_LINE} bytes.")
+        
+        for line in lines:
+            fields = line.decode("utf-8", errors="replace").split()
+            if not fields:
+                continue
+            
+            uncharged += 1
+            if uncharged >= DNS_STREAM_CHARGE_BLOCK:
+                await rate_limit_middleware(None, api_key, api_key_obj, cost=uncharged)
+                uncharged = 0
+            
+            yield fields[0], fields[1] if len(fields) > 1 else record_type
+    
+    fields = buffer.decode("utf-8", errors="replace").split()
+    if fields:
+        uncharged += 1
+        yield fields[0], fields[1] if len(fields) > 1 else record_type
+    
+    if uncharged:
+        await rate_limit_middleware(None, api_key, api_key_obj, cost=uncharged)
+
+
+@router.post("/dns/stream")
+async def dns_stream(
+    request: Request,
+    record_type: str = Query("A", description="Default DNS record type for lines without one"),
+    dnssec: bool = Query(False, description="Whether to perform DNSSEC validation"),
+    api_key_info: Tuple[str, ApiKey] = Depends(get_api_key)
+):
+    """
+    Resolve a newline-delimited stream of domains
+    Each result is sent as an NDJSON line as soon as it completes, followed by a summary line
+    """
+    api_key, api_key_obj = api_key_info
+    
+    # Apply rate limiting to the request itself, names are charged as they are read
+    rate_limit = await rate_limit_middleware(None, api_key, api_key_obj)
+    
+    queries = _read_stream_queries(request, record_type, api_key, api_key_obj)
+    
+    async def ndjson():
+        async for result in dns_service.stream_lookup(queries, dnssec):
+            if "summary" in result:
+                await log_dns_stream(api_key, api_key_obj.name, result["summary"])
+            yield dumps(result) + b"\n"
+    
+    return DuplexStreamingResponse(
+        ndjson(),
+        media_type="application/x-ndjson",
+        headers=rate_limit.headers() if rate_limit else None
+    )
+
+
+async def _dns_message_response(wire: bytes, api_key: str, api_key_obj: ApiKey) -> Response:
+    """Answer a wire-format DNS query with a wire-format DNS response"""
+    rate_limit = await rate_limit_middleware(None, api_key, api_key_obj)
+    
+    try:
+        answer, ttl, cached = await dns_service.wire_lookup(wire)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    with phase("log"):
+        await log_dns_message(api_key, api_key_obj.name, len(answer), cached)
+    
+    headers = rate_limit.headers() if rate_limit else {}
+    headers["Cache-Control"] = f"max-age={ttl}"
+    return Response(content=answer, media_type=DNS_MESSAGE_MEDIA_TYPE, headers=headers)
+
+
+@router.get("/dns-query", response_class=Response)
+async def dns_query_get(
+    dns_message: str = Query(..., alias="dns", description="DNS query message, base64url encoded without padding"),
+    api_key_info: Tuple[str, ApiKey] = Depends(get_api_key)
+):
+    """
+    Answer a DNS query in wire format, DNS over HTTPS style (RFC 8484)
+    """
+    api_key, api_key_obj = api_key_info
+    
+    if len(dns_message) > DNS_MESSAGE_MAX_SIZE * 4 // 3 + 4:
+        raise HTTPException(status_code=414, detail="DNS message too large")
+    
+    try:
+        wire = base64.urlsafe_b64decode(dns_message + "=" * (-len(dns_message) % 4))
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid base64url DNS message")
+    
+    return await _dns_message_response(wire, api_key, api_key_obj)
+
+
+@router.post("/dns-query", response_class=Response)
+async def dns_query_post(
+    request: Request,
+    api_key_info: Tuple[str, ApiKey] = Depends(get_api_key)
+):
+    """
+    Answer a DNS query sent as an application/dns-message body (RFC 8484)
+    """
+    api_key, api_key_obj = api_key_info
+    
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type != DNS_MESSAGE_MEDIA_TYPE:
+        raise HTTPException(status_code=415, detail=f"Content-Type must be {DNS_MESSAGE_MEDIA_TYPE}")
+    
+    wire = await request.body()
+    if len(wire) > DNS_MESSAGE_MAX_SIZE:
+        raise HTTPException(status_code=413, detail="DNS message too large")
     
-    return result
+    return await _dns_message_response(wire, api_key, api_key_obj)
 
 
-@router.get("/whois", response_model=Dict[str, Any])
+@router.get("/whois", response_class=FastJSONResponse)
 async def whois_lookup(
+    response: Response,
     domain: str = Query(..., description="Domain to lookup WHOIS information for"),
     exclude_empty: bool = Query(True, description="Whether to exclude empty fields from the response"),
+    include_raw: bool = Query(True, description="Whether to include the raw WHOIS text"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
     api_key_info: Tuple[str, ApiKey] = Depends(get_api_key)
 ):
     """
@@ -100,15 +311,55 @@ async def whois_lookup(
     api_key, api_key_obj = api_key_info
     
     # Apply rate limiting
-    await rate_limit_middleware(None, api_key, api_key_obj)
+    await rate_limit_middleware(response, api_key, api_key_obj)
     
     # Perform WHOIS lookup
-    result = await whois_service.lookup(domain, exclude_empty)
+    result = await whois_service.lookup(domain, exclude_empty, include_raw)
     
     # Log the query
-    await log_whois_query(api_key, api_key_obj.name, domain, result)
+    with phase("log"):
+        await log_whois_query(api_key, api_key_obj.name, domain, result)
     
-    return result
+    return json_response(result, response, fields)
+
+
+@router.get("/domain/profile", response_class=FastJSONResponse)
+async def domain_profile(
+    response: Response,
+    domain: str = Query(..., description="Domain to profile"),
+    record_types: str = Query(",".join(DEFAULT_PROFILE_TYPES), description="Comma-separated DNS record types to resolve"),
+    whois: bool = Query(False, description="Whether to include WHOIS information"),
+    dnssec: bool = Query(False, description="Whether to perform DNSSEC validation"),
+    include_raw: bool = Query(False, description="Whether to include the raw WHOIS text"),
+    timeout: Optional[float] = Query(None, gt=0, description="Seconds to wait for answers, capped by DOMAIN_PROFILE_TIMEOUT"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    api_key_info: Tuple[str, ApiKey] = Depends(get_api_key)
+):
+    """
+    Resolve several record types and optionally WHOIS for a domain concurrently
+    Queries that do not finish in time are listed in timed_out, the rest is returned
+    """
+    api_key, api_key_obj = api_key_info
+    
+    try:
+        types = parse_record_types(record_types)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if not types and not whois:
+        raise HTTPException(status_code=400, detail="Profile must include at least one record type or WHOIS")
+    
+    # Apply rate limiting, one charge weighted by the queries of the profile
+    await rate_limit_middleware(response, api_key, api_key_obj, cost=domain_profile_service.cost(types, whois))
+    
+    # Run the queries
+    result = await domain_profile_service.profile(domain, types, whois, dnssec, include_raw, timeout)
+    
+    # Log the profile
+    with phase("log"):
+        await log_domain_profile(api_key, api_key_obj.name, domain, result)
+    
+    return json_response(result, response, fields)
 
 
 # API Key management endpoints
@@ -125,15 +376,21 @@ async def create_api_key(
 
 @router.get("/admin/api-keys", response_model=List[ApiKey])
 async def get_api_keys(
+    response: Response,
+    cursor: int = Query(0, ge=0, description="Cursor returned in X-Next-Cursor by the previous page"),
+    limit: int = Query(100, ge=1, le=1000, description="Approximate number of keys per page"),
     _: str = Depends(get_admin_secret)  # Require admin secret
 ):
     """
-    Get all API keys
+    Get a page of API keys
+    The cursor for the next page is returned in the X-Next-Cursor header, 0 means no more pages
     """
-    return await api_key_service.get_all_api_keys()
+    keys, next_cursor = await api_key_service.get_api_keys(cursor, limit)
+    response.headers["X-Next-Cursor"] = str(next_cursor)
+    return keys
 
 
-@router.delete("/admin/api-keys/{api_key}", response_model=Dict[str, bool])
+@router.delete("/admin/api-keys/{api_key}", response_class=FastJSONResponse)
 async def deactivate_api_key(
     api_key: str,
     _: str = Depends(get_admin_secret)  # Require admin secret
@@ -142,4 +399,60 @@ async def deactivate_api_key(
     Deactivate an API key
     """
     success = await api_key_service.deactivate_api_key(api_key)
-    return {"success": success} 
\ No newline at end of file
+    return json_response({"success": success})
+
+@router.get("/admin/stats", response_class=FastJSONResponse)
+async def get_stats(
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    _: str = Depends(get_admin_secret)  # Require admin secret
+):
+    """
+    Get cache and service counters for this worker
+    """
+    return json_response({
+        "dns": dns_service.stats(),
+        "whois": whois_service.stats(),
+        "api_key_cache": api_key_cache.stats(),
+        "logging": log_pipeline.stats()
+    }, fields=fields)
+
+
+@router.get("/admin/slow-requests", response_class=FastJSONResponse)
+async def get_slow_requests(
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    _: str = Depends(get_admin_secret)  # Require admin secret
+):
+    """
+    Get the slowest requests served by this worker, with the time spent in each phase
+    """
+    return json_response({"requests": slow_requests.entries()}, fields=fields)
+
+
+@router.delete("/admin/slow-requests", response_class=FastJSONResponse)
+async def clear_slow_requests(
+    _: str = Depends(get_admin_secret)  # Require admin secret
+):
+    """
+    Forget the slow requests recorded by this worker
+    """
+    slow_requests.clear()
+    return json_response({"success": True})
+
+
+@router.get("/admin/profile", response_class=PlainTextResponse)
+async def profile_worker(
+    seconds: float = Query(10, gt=0, description="How long to sample, capped by PROFILER_MAX_SECONDS"),
+    interval_ms: float = Query(5, ge=1, le=1000, description="Time between samples in milliseconds"),
+    idle: bool = Query(False, description="Whether to include samples taken while the worker waits for I/O"),
+    _: str = Depends(get_admin_secret)  # Require admin secret
+):
+    """
+    Profile this worker while it serves requests
+    Returns sampled stacks in the collapsed format read by flamegraph.pl and speedscope
+    """
+    try:
+        stacks = await profiler.profile(seconds, interval_ms / 1000, idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(collapsed_stacks(stacks))
+
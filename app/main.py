@@ -1,33 +1,93 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from loguru import logger
-import sys
 
-from app.api.router import router
+from app.api.router import router, dns_service, whois_service
+from app.api.responses import FastJSONResponse
+from app.middleware.compression import CompressionMiddleware
 from app.middleware.logger import log_request_middleware
+from app.middleware.metrics import MetricsMiddleware
+from app.middleware.rate_limit import rate_limiter
+from app.middleware.timing import TimingMiddleware
+from app.services.redis_pool import init_redis, close_redis
+from app.services.api_key_cache import api_key_cache
+from app.services.api_key_service import ApiKeyService
+from app.services.metrics import cache_collector, registry
+from app.services.metrics_exporter import METRICS_CONTENT_TYPE, MetricsExporter
+from app.services.log_pipeline import log_pipeline
+from app.services.snapshot import CacheSnapshot
 
 # Configure Loguru
-logger.remove()  # Remove default handlers
-logger.add(
-    sys.stdout,
-    format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}",
-    level="INFO",
-)
-logger.add(
-    "logs/api.log",
-    rotation="500 MB",
-    retention="10 days",
-    format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}",
-    level="INFO",
-)
+log_pipeline.configure()
+
+# In-process caches saved across restarts
+cache_snapshot = CacheSnapshot({"dns": dns_service, "whois": whois_service})
+
+# Prometheus metrics, summed over the workers of the host
+registry.register_collector(cache_collector({
+    "dns": dns_service.cache,
+    "dns_l2": dns_service.l2_cache,
+    "whois": whois_service.cache,
+    "whois_l2": whois_service.l2_cache,
+}))
+registry.register_collector(log_pipeline.metrics)
+metrics_exporter = MetricsExporter(registry)
+
+
+async def warm_up(app: FastAPI):
+    """Finish warming up in the background, then report ready"""
+    try:
+        await dns_service.warm_up()
+    except Exception as e:
+        logger.error(f"Warm-up failed: {e}")
+    app.state.ready = True
+    logger.info("Ready")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    # Open the shared Redis connection pool
+    await init_redis()
+    # Convert API keys stored by earlier versions
+    try:
+        await ApiKeyService().migrate_legacy_keys()
+    except Exception as e:
+        logger.error(f"API key migration failed: {e}")
+    # Follow API key changes made by other workers
+    await api_key_cache.start()
+    # Restore cached results saved before the last shutdown
+    await cache_snapshot.restore()
+    await cache_snapshot.start()
+    # Share this worker's metrics with the other workers
+    await metrics_exporter.start()
+    # Probe upstream nameservers
+    await dns_service.start()
+    warm_up_task = asyncio.create_task(warm_up(app))
+    yield
+    app.state.ready = False
+    warm_up_task.cancel()
+    await dns_service.stop()
+    await whois_service.stop()
+    await cache_snapshot.stop()
+    await metrics_exporter.stop()
+    await api_key_cache.stop()
+    # Return rate limit quota leased by this worker
+    await rate_limiter.stop()
+    await close_redis()
+
 
 # Create the FastAPI app
 app = FastAPI(
     title="Fast Resolver API",
     description="Asynchronous REST API for DNS and WHOIS operations",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -39,6 +99,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large responses
+app.add_middleware(CompressionMiddleware)
+
+# Record request latency, including compression
+app.add_middleware(MetricsMiddleware)
+
+# Time request phases for Server-Timing and the slow request log
+app.add_middleware(TimingMiddleware)
+
 # Add request logging middleware
 @app.middleware("http")
 async def logging_middleware(request: Request, call_next):
@@ -68,4 +137,16 @@ async def root():
 # Health check endpoint
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"} 
\ No newline at end of file
+    return {"status": "ok"}
+
+# Readiness check endpoint, succeeds once the worker has warmed up
+@app.get("/ready")
+async def readiness_check():
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready"}
+
+# Prometheus metrics endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(await metrics_exporter.render(), media_type=METRICS_CONTENT_TYPE)
@@ -4,6 +4,7 @@ from typing import Optional, Tuple
 from loguru import logger
 import os
 from app.services.api_key_service import ApiKeyService
+from app.services.timing import phase
 from app.models.api_key import ApiKey
 
 
@@ -13,6 +14,9 @@ admin_secret_header = APIKeyHeader(name="X-Admin-Secret", auto_error=False)
 
 api_key_service = ApiKeyService()
 
+# Logger of successful validations, sampled with LOG_SAMPLING
+auth_logger = logger.bind(category="auth")
+
 
 async def get_api_key(
     api_key: str = Depends(api_key_header),
@@ -29,7 +33,8 @@ async def get_api_key(
             detail="Missing API key or secret"
         )
     
-    api_key_obj = await api_key_service.validate_api_key(api_key, api_secret)
+    with phase("auth"):
+        api_key_obj = await api_key_service.validate_api_key(api_key, api_secret)
     
     if not api_key_obj:
         logger.warning(f"Invalid API key: {api_key}")
@@ -38,7 +43,7 @@ async def get_api_key(
             detail="Invalid API key or secret"
         )
     
-    logger.info(f"API key validated: {api_key} (name: {api_key_obj.name})")
+    auth_logger.info(f"API key validated: {api_key} (name: {api_key_obj.name})")
     
     return api_key, api_key_obj
 
@@ -1,10 +1,16 @@
 import time
 import json
-from typing import Callable, Dict, Any
+from typing import Callable, Dict, Any, List
 from fastapi import Request, Response
 from loguru import logger
 
 
+# Loggers per category, sampled with LOG_SAMPLING
+request_logger = logger.bind(category="request")
+dns_logger = logger.bind(category="dns")
+whois_logger = logger.bind(category="whois")
+
+
 async def log_request_middleware(request: Request, call_next: Callable):
     """Log request and response information"""
     start_time = time.time()
@@ -19,7 +25,9 @@ async def log_request_middleware(request: Request, call_next: Callable):
     api_key = request.headers.get("X-API-Key", "unknown")
     
     # Log request info
-    logger.info(f"Request: {method} {path} from {client_ip} API Key: {api_key}")
+    request_logger.bind(method=method, path=path, client_ip=client_ip, api_key=api_key).info(
+        f"Request: {method} {path} from {client_ip} API Key: {api_key}"
+    )
     
     # Get response
     response = await call_next(request)
@@ -27,8 +35,15 @@ async def log_request_middleware(request: Request, call_next: Callable):
     # Calculate process time
     process_time = time.time() - start_time
     
-    # Log response info
-    logger.info(
+    # Log response info, server errors are never sampled out
+    request_logger.bind(
+        method=method,
+        path=path,
+        status=response.status_code,
+        took=round(process_time, 4),
+        api_key=api_key
+    ).log(
+        "WARNING" if response.status_code >= 500 else "INFO",
         f"Response: {method} {path} status={response.status_code} "
         f"took={process_time:.4f}s API Key: {api_key}"
     )
@@ -45,26 +60,79 @@ async def log_dns_query(api_key: str, api_key_name: str, query_type: str, query:
     dnssec_validated = "validated" if dnssec_info.get("validated") else "not validated"
     dnssec_str = f" [DNSSEC: {dnssec_validated}]" if dnssec_info else ""
     
+    query_logger = dns_logger.bind(api_key_name=api_key_name, query_type=query_type, query=query, status=status)
     if status == "success":
         if query_type in ["lookup", "reverse_lookup", "ptr"]:
             targets = result.get("results", []) if query_type == "lookup" else result.get("domains", [])
             target_str = ", ".join(targets) if targets else "no results"
-            logger.info(f"DNS {query_type}: API Key '{api_key}' (name: {api_key_name}) queried '{query}' -> {target_str}{dnssec_str}")
+            query_logger.info(f"DNS {query_type}: API Key '{api_key}' (name: {api_key_name}) queried '{query}' -> {target_str}{dnssec_str}")
         else:
-            logger.info(f"DNS {query_type}: API Key '{api_key}' (name: {api_key_name}) queried '{query}' -> success{dnssec_str}")
+            query_logger.info(f"DNS {query_type}: API Key '{api_key}' (name: {api_key_name}) queried '{query}' -> success{dnssec_str}")
     else:
         error = result.get("error", "unknown error")
-        logger.warning(f"DNS {query_type}: API Key '{api_key}' (name: {api_key_name}) queried '{query}' -> error: {error}{dnssec_str}")
+        query_logger.warning(f"DNS {query_type}: API Key '{api_key}' (name: {api_key_name}) queried '{query}' -> error: {error}{dnssec_str}")
+
+
+async def log_dns_batch(api_key: str, api_key_name: str, results: List[Dict[str, Any]]):
+    """Log a summary of a DNS batch query"""
+    errors = sum(1 for result in results if result.get("status") != "success")
+    cached = sum(1 for result in results if result.get("cached"))
+    dns_logger.info(
+        f"DNS batch: API Key '{api_key}' (name: {api_key_name}) queried {len(results)} items "
+        f"-> {len(results) - errors} succeeded, {errors} failed, {cached} cached"
+    )
+
+
+async def log_dns_stream(api_key: str, api_key_name: str, summary: Dict[str, Any]):
+    """Log the summary of a DNS stream query"""
+    error = summary.get("error")
+    message = (
+        f"DNS stream: API Key '{api_key}' (name: {api_key_name}) queried {summary.get('total', 0)} names "
+        f"-> {summary.get('succeeded', 0)} succeeded, {summary.get('failed', 0)} failed, {summary.get('cached', 0)} cached"
+    )
+    if error:
+        dns_logger.warning(f"{message}, stopped: {error}")
+    else:
+        dns_logger.info(message)
+
+
+async def log_dns_message(api_key: str, api_key_name: str, size: int, cached: bool):
+    """Log a DNS wire-format query"""
+    dns_logger.info(
+        f"DNS message: API Key '{api_key}' (name: {api_key_name}) sent a query "
+        f"-> {size} byte answer{' (cached)' if cached else ''}"
+    )
+
+
+async def log_domain_profile(api_key: str, api_key_name: str, domain: str, profile: Dict[str, Any]):
+    """Log the summary of a domain profile"""
+    records = profile.get("records", {})
+    failed = sum(1 for result in records.values() if result.get("status") != "success")
+    whois = profile.get("whois")
+    whois_str = f", WHOIS {whois.get('status', 'unknown')}" if whois is not None else ""
+    timed_out = profile.get("timed_out", [])
+    timed_out_str = f", timed out: {', '.join(timed_out)}" if timed_out else ""
+    message = (
+        f"Domain profile: API Key '{api_key}' (name: {api_key_name}) queried '{domain}' -> "
+        f"{len(records) - failed} of {len(records)} record types resolved{whois_str}{timed_out_str}"
+    )
+    
+    query_logger = dns_logger.bind(api_key_name=api_key_name, query_type="profile", query=domain, status=profile.get("status"))
+    if timed_out:
+        query_logger.warning(message)
+    else:
+        query_logger.info(message)
 
 
 async def log_whois_query(api_key: str, api_key_name: str, domain: str, result: Dict[str, Any]):
     """Log WHOIS query information"""
     status = result.get("status", "unknown")
     
+    query_logger = whois_logger.bind(api_key_name=api_key_name, domain=domain, status=status)
     if status == "success":
         registrar = result.get("registrar", "unknown")
         creation_date = result.get("creation_date", "unknown")
-        logger.info(f"WHOIS: API Key '{api_key}' (name: {api_key_name}) queried '{domain}' -> Registrar: {registrar}, Created: {creation_date}")
+        query_logger.info(f"WHOIS: API Key '{api_key}' (name: {api_key_name}) queried '{domain}' -> Registrar: {registrar}, Created: {creation_date}")
     else:
         error = result.get("error", "unknown error")
-        logger.warning(f"WHOIS: API Key '{api_key}' (name: {api_key_name}) queried '{domain}' -> error: {error}") 
\ No newline at end of file
+        query_logger.warning(f"WHOIS: API Key '{api_key}' (name: {api_key_name}) queried '{domain}' -> error: {error}") 
\ No newline at end of file
@@ -0,0 +1,51 @@
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.services.timing import RequestTiming, current_timing, slow_requests
+
+
+class TimingMiddleware:
+    """
+    Time the phases of every request
+
+    Timings cover the request up to its response headers, when the body of
+    a JSON response is already rendered. The slowest requests are kept in
+    the slow request log. SERVER_TIMING selects when timings are returned
+    in a Server-Timing header: "request" when the request has an
+    X-Server-Timing: 1 header, "always", or "never".
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.mode = os.getenv("SERVER_TIMING", "request").lower()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        report = self.mode == "always" or (
+            self.mode == "request" and Headers(scope=scope).get("x-server-timing") == "1"
+        )
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                elapsed = timing.elapsed()
+                if report:
+                    MutableHeaders(scope=message)["Server-Timing"] = timing.server_timing(elapsed)
+                query = scope.get("query_string", b"").decode("latin-1")
+                slow_requests.record(elapsed, {
+                    "method": scope["method"],
+                    "path": f"{scope['path']}?{query}" if query else scope["path"],
+                    "status": message["status"],
+                }, timing)
+            await send(message)
+
+        token = current_timing.set(timing)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timing.reset(token)
@@ -0,0 +1,21 @@
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional
+
+
+class DNSBatchItem(BaseModel):
+    """A single query in a DNS batch: either a forward lookup or a reverse lookup"""
+    domain: Optional[str] = Field(default=None, description="Domain to lookup")
+    record_type: str = Field(default="A", description="DNS record type (A, AAAA, MX, TXT, etc.)")
+    ip: Optional[str] = Field(default=None, description="IP address for a reverse lookup")
+    dnssec: bool = Field(default=False, description="Whether to perform DNSSEC validation")
+
+    @model_validator(mode="after")
+    def check_target(self):
+        if (self.domain is None) == (self.ip is None):
+            raise ValueError("Exactly one of 'domain' or 'ip' must be set")
+        return self
+
+
+class DNSBatchRequest(BaseModel):
+    """Model for a batch of DNS queries"""
+    items: List[DNSBatchItem]
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+from app.models.api_key import ApiKey
+from app.services.redis_pool import get_redis
+
+
+# Pub/sub channel carrying the API keys whose records changed
+INVALIDATION_CHANNEL = "api_key_invalidations"
+
+
+def secret_digest(api_secret: str) -> bytes:
+    """Digest of an API secret, so cached records never hold the plaintext"""
+    return hashlib.sha256(api_secret.encode()).digest()
+
+
+class CachedApiKey:
+    """A cached API key record with a digest in place of its secret"""
+    __slots__ = ("api_key_obj", "digest", "expires_at")
+
+    def __init__(self, api_key_obj: ApiKey, digest: bytes, expires_at: float):
+        self.api_key_obj = api_key_obj
+        self.digest = digest
+        self.expires_at = expires_at
+
+    def matches(self, api_secret: str) -> bool:
+        """Check a secret against the cached digest in constant time"""
+        return hmac.compare_digest(self.digest, secret_digest(api_secret))
+
+
+class ApiKeyCache:
+    """
+    Per-worker cache of API key records with a short TTL
+
+    Entries are dropped early when any worker publishes the key on
+    INVALIDATION_CHANNEL, so revocations apply everywhere almost at once.
+    The TTL bounds staleness if an invalidation is missed.
+    """
+
+    def __init__(self):
+        self.ttl = float(os.getenv("API_KEY_CACHE_TTL", 30))
+        self.max_entries = int(os.getenv("API_KEY_CACHE_MAX_ENTRIES", 10000))
+        self._entries: "OrderedDict[str, CachedApiKey]" = OrderedDict()
+        self._listener: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, api_key: str) -> Optional[CachedApiKey]:
+        """Return the live cached record for an API key, or None on a miss"""
+        entry = self._entries.get(api_key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(api_key)
+        return entry
+
+    def put(self, api_key_obj: ApiKey) -> None:
+        """Cache a key record, keeping only a digest of its secret"""
+        if not self.enabled:
+            return
+
+        cached_obj = api_key_obj.model_copy(update={"api_secret": ""})
+        self._entries[api_key_obj.api_key] = CachedApiKey(
+            cached_obj,
+            secret_digest(api_key_obj.api_secret),
+            time.monotonic() + self.ttl,
+        )
+        self._entries.move_to_end(api_key_obj.api_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, api_key: str) -> None:
+        """Drop a key from this worker's cache"""
+        if self._entries.pop(api_key, None) is not None:
+            self.invalidations += 1
+
+    async def publish_invalidation(self, api_key: str) -> None:
+        """Drop a key here and tell every other worker to drop it"""
+        self.invalidate(api_key)
+        try:
+            await get_redis().publish(INVALIDATION_CHANNEL, api_key)
+        except Exception as e:
+            logger.error(f"Failed to publish API key invalidation: {e}")
+
+    async def start(self) -> None:
+        """Start listening for invalidations from other workers"""
+        if self.enabled and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        """Stop the invalidation listener"""
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self) -> None:
+        retry_delay = 1.0
+        while True:
+            pubsub = get_redis().pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Anything published while we were not subscribed was missed
+                self._entries.clear()
+                retry_delay = 1.0
+
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.invalidate(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"API key invalidation listener error: {e}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30.0)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cache counters"""
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "listening": self._listener is not None and not self._listener.done(),
+        }
+
+
+# Shared by every ApiKeyService in the worker
+api_key_cache = ApiKeyCache()
@@ -1,23 +1,30 @@
-import os
 import uuid
 import json
-import redis
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 from loguru import logger
 from app.models.api_key import ApiKey, ApiKeyCreate, ApiKeyInDB
+from app.services.redis_pool import get_redis
+from app.services.api_key_cache import api_key_cache
 
 
 class ApiKeyService:
+    """
+    API key store
+    
+    Each key is a Redis hash at api_key:id:{id}, with api_key:{api_key}
+    holding the id as a secondary index and the api_keys set listing all ids.
+    """
+    
     def __init__(self):
-        # Initialize Redis connection
-        redis_host = os.getenv("REDIS_HOST", "localhost")
-        redis_port = int(os.getenv("REDIS_PORT", 6379))
-        self.redis = redis.Redis(host=redis_host, port=redis_port, decode_responses=True)
-        
         # Key prefix for storing API keys
         self.key_prefix = "api_key:"
     
+    @property
+    def redis(self):
+        """Shared async Redis client"""
+        return get_redis()
+    
     def _generate_api_key(self) -> str:
         """Generate a unique API key"""
         return str(uuid.uuid4())
@@ -26,6 +33,23 @@ class ApiKeyService:
         """Generate a unique API secret"""
         return str(uuid.uuid4())
     
+    def _record_key(self, key_id: str) -> str:
+        return f"{self.key_prefix}id:{key_id}"
+    
+    def _index_key(self, api_key: str) -> str:
+        return f"{self.key_prefix}{api_key}"
+    
+    def _to_hash(self, key_id: str, api_key_obj: ApiKey) -> Dict[str, str]:
+        """Flatten an API key into hash fields"""
+        fields = api_key_obj.model_dump(mode="json")
+        fields["id"] = key_id
+        fields["is_active"] = int(fields["is_active"])
+        return {field: str(value) for field, value in fields.items()}
+    
+    def _from_hash(self, fields: Dict[str, str]) -> ApiKey:
+        """Build an API key from hash fields"""
+        return ApiKey(**fields)
+    
     async def create_api_key(self, api_key_data: ApiKeyCreate) -> ApiKey:
         """Create a new API key"""
         api_key = self._generate_api_key()
@@ -40,71 +64,108 @@ class ApiKeyService:
             is_active=True
         )
         
-        # Store in Redis - use model_dump() which properly handles datetime serialization
         key_id = str(uuid.uuid4())
-        self.redis.set(
-            f"{self.key_prefix}{api_key}",
-            json.dumps(new_key.model_dump(mode="json"))
-        )
         
-        # Also store by ID for listing all keys
-        self.redis.set(
-            f"{self.key_prefix}id:{key_id}",
-            json.dumps(new_key.model_dump(mode="json"))
-        )
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._record_key(key_id), mapping=self._to_hash(key_id, new_key))
+            # Secondary index from the API key to its record
+            pipe.set(self._index_key(api_key), key_id)
+            # Add to index of all keys
+            pipe.sadd("api_keys", key_id)
+            await pipe.execute()
         
-        # Add to index of all keys
-        self.redis.sadd("api_keys", key_id)
+        await api_key_cache.publish_invalidation(api_key)
         
         return new_key
     
     async def validate_api_key(self, api_key: str, api_secret: str) -> Optional[ApiKey]:
         """Validate an API key and secret"""
-        key_data = self.redis.get(f"{self.key_prefix}{api_key}")
+        cached = api_key_cache.get(api_key)
+        if cached is not None:
+            if not cached.api_key_obj.is_active or not cached.matches(api_secret):
+                return None
+            return cached.api_key_obj
+        
+        key_id = await self.redis.get(self._index_key(api_key))
+        if not key_id:
+            return None
         
-        if not key_data:
+        fields = await self.redis.hgetall(self._record_key(key_id))
+        if not fields:
             return None
         
-        key_dict = json.loads(key_data)
-        api_key_obj = ApiKey(**key_dict)
+        api_key_obj = self._from_hash(fields)
+        api_key_cache.put(api_key_obj)
         
         if api_key_obj.api_secret != api_secret or not api_key_obj.is_active:
             return None
         
         return api_key_obj
     
-    async def get_all_api_keys(self) -> List[ApiKey]:
-        """Get all API keys"""
-        key_ids = self.redis.smembers("api_keys")
-        keys = []
-        
-        for key_id in key_ids:
-            key_data = self.redis.get(f"{self.key_prefix}id:{key_id}")
-            if key_data:
-                keys.append(ApiKey(**json.loads(key_data)))
-        
-        return keys
+    async def get_api_keys(self, cursor: int = 0, count: int = 100) -> Tuple[List[ApiKey], int]:
+        """
+        Get a page of API keys
+        
+        Returns the keys and the cursor for the next page, which is 0 once
+        every key has been returned. count is a hint, a page may hold more
+        or fewer keys.
+        """
+        next_cursor, key_ids = await self.redis.sscan("api_keys", cursor, count=count)
+        if not key_ids:
+            return [], next_cursor
+        
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key_id in key_ids:
+                pipe.hgetall(self._record_key(key_id))
+            records = await pipe.execute()
+        
+        return [self._from_hash(fields) for fields in records if fields], next_cursor
     
     async def deactivate_api_key(self, api_key: str) -> bool:
         """Deactivate an API key"""
-        key_data = self.redis.get(f"{self.key_prefix}{api_key}")
+        key_id = await self.redis.get(self._index_key(api_key))
         
-        if not key_data:
+        if not key_id:
             return False
         
-        key_dict = json.loads(key_data)
-        key_dict["is_active"] = False
-        
-        self.redis.set(f"{self.key_prefix}{api_key}", json.dumps(key_dict))
+        await self.redis.hset(self._record_key(key_id), "is_active", "0")
         
-        # Also update in the ID index
-        for key_id in self.redis.smembers("api_keys"):
-            id_key_data = self.redis.get(f"{self.key_prefix}id:{key_id}")
-            if id_key_data:
-                id_key_dict = json.loads(id_key_data)
-                if id_key_dict.get("api_key") == api_key:
-                    id_key_dict["is_active"] = False
-                    self.redis.set(f"{self.key_prefix}id:{key_id}", json.dumps(id_key_dict))
-                    break
+        await api_key_cache.publish_invalidation(api_key)
         
-        return True 
\ No newline at end of file
+        return True
+    
+    async def migrate_legacy_keys(self) -> int:
+        """
+        Convert API keys stored as JSON strings to the hash layout
+        
+        Earlier versions stored a JSON copy of each key at both
+        api_key:{api_key} and api_key:id:{id}. Safe to run repeatedly.
+        Returns the number of keys converted.
+        """
+        migrated = 0
+        async for key_id in self.redis.sscan_iter("api_keys", count=500):
+            record_key = self._record_key(key_id)
+            if await self.redis.type(record_key) != "string":
+                continue
+            
+            id_key_data = await self.redis.get(record_key)
+            if not id_key_data:
+                continue
+            key_dict = json.loads(id_key_data)
+            api_key = key_dict["api_key"]
+            
+            # Deactivation updated the copy at api_key:{api_key} first
+            key_data = await self.redis.get(self._index_key(api_key))
+            if key_data and key_data.startswith("{"):
+                key_dict["is_active"] = key_dict.get("is_active", True) and json.loads(key_data).get("is_active", True)
+            
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(record_key)
+                pipe.hset(record_key, mapping=self._to_hash(key_id, ApiKey(**key_dict)))
+                pipe.set(self._index_key(api_key), key_id)
+                await pipe.execute()
+            migrated += 1
+        
+        if migrated:
+            logger.info(f"Migrated {migrated} API keys to the hash layout")
+        return migrated
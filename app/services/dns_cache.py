@@ -0,0 +1,155 @@
+import os
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+import dns.name
+
+
+# Cache key: (query name, rdtype, dnssec)
+CacheKey = Tuple[dns.name.Name, int, bool]
+
+# Rough per-entry bookkeeping cost (key tuple, entry object, dict slots)
+ENTRY_OVERHEAD = 256
+
+
+class CacheEntry:
+    """A cached DNS answer or negative answer"""
+    __slots__ = ("results", "error_kind", "error", "dnssec", "wire", "ttl", "expires_at", "size")
+
+    def __init__(
+        self,
+        results: List[str],
+        wire: bytes,
+        ttl: int,
+        error_kind: Optional[str] = None,
+        error: Optional[str] = None,
+        dnssec: Optional[Dict[str, Any]] = None,
+        expires_at: Optional[float] = None,
+    ):
+        self.results = results
+        self.error_kind = error_kind  # None, "nxdomain" or "noanswer"
+        self.error = error
+        self.dnssec = dnssec
+        self.wire = wire
+        self.ttl = ttl
+        self.expires_at = expires_at if expires_at is not None else time.time() + ttl
+        self.size = ENTRY_OVERHEAD + len(wire) + sum(len(r) for r in results)
+
+    @property
+    def negative(self) -> bool:
+        return self.error_kind is not None
+
+    def ttl_remaining(self, now: Optional[float] = None) -> int:
+        """Seconds left before this entry expires"""
+        now = time.time() if now is None else now
+        return max(0, math.ceil(self.expires_at - now))
+
+
+class DNSCache:
+    """
+    Bounded LRU cache for DNS answers that honours record TTLs
+
+    Positive answers live for the TTL of their RRset, negative answers
+    (NXDOMAIN / NoAnswer) for the SOA minimum as described in RFC 2308.
+    Both are clamped to [min_ttl, max_ttl].
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        min_ttl: Optional[int] = None,
+        max_ttl: Optional[int] = None,
+        negative_ttl: Optional[int] = None,
+    ):
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("DNS_CACHE_MAX_ENTRIES", 100000))
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("DNS_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+        self.min_ttl = min_ttl if min_ttl is not None else int(os.getenv("DNS_CACHE_MIN_TTL", 0))
+        self.max_ttl = max_ttl if max_ttl is not None else int(os.getenv("DNS_CACHE_MAX_TTL", 86400))
+        # Used for negative answers that carry no SOA record
+        self.negative_ttl = negative_ttl if negative_ttl is not None else int(os.getenv("DNS_CACHE_NEGATIVE_TTL", 60))
+
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def clamp_ttl(self, ttl: int) -> int:
+        """Clamp a TTL to the configured bounds"""
+        return max(self.min_ttl, min(self.max_ttl, ttl))
+
+    def get(self, key: CacheKey) -> Optional[CacheEntry]:
+        """Return a live entry for the key, or None on a miss"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry.expires_at <= time.time():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def peek(self, key: CacheKey) -> Optional[CacheEntry]:
+        """Return the entry for a key, even if expired, without touching LRU order or counters"""
+        return self._entries.get(key)
+
+    def put(self, key: CacheKey, entry: CacheEntry) -> None:
+        """Store an entry, evicting least recently used entries as needed"""
+        if not self.enabled or entry.ttl <= 0 or entry.size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = entry
+        self._bytes += entry.size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def items(self) -> List[Tuple[CacheKey, CacheEntry]]:
+        """All entries, least recently used first"""
+        return list(self._entries.items())
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def _remove(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cache counters"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
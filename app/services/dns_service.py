@@ -1,18 +1,49 @@
 import dns.resolver
-from dns.asyncresolver import Resolver
 import dns.reversename
+import dns.name
+import dns.rdatatype
+import dns.rdataclass
+import dns.message
+import dns.rcode
+import dns.flags
+import dns.opcode
 from loguru import logger
+import os
+import math
+import time
 import socket
 import asyncio
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
 import dns.dnssec
 
+from app.services.dns_cache import DNSCache, CacheEntry
+from app.services.single_flight import SingleFlight
+from app.services.l2_cache import RedisResultCache
+from app.services.prefetch import Prefetcher
+from app.services.resolver_pool import ResolverPool
+from app.services.timing import phase
+from app.services.upstreams import UpstreamManager
+from app.models.dns import DNSBatchItem
+
 
 class DNSService:
     def __init__(self):
-        self.resolver = Resolver()
-        # Use default DNS servers
-        self.resolver.nameservers = ['8.8.8.8', '8.8.4.4', '1.1.1.1', '1.0.0.1']
+        # Health-tracked upstream nameservers, fastest first
+        self.upstreams = UpstreamManager()
+        # One immutable resolver per set of options (DNSSEC, timeout, upstreams)
+        self.resolvers = ResolverPool(self.upstreams)
+        # In-process answer cache
+        self.cache = DNSCache()
+        # Answers shared with other workers through Redis, in DNS wire format
+        self.l2_cache = RedisResultCache("dns")
+        # Identical queries in flight share one upstream resolution
+        self.single_flight = SingleFlight()
+        # Popular answers are refreshed shortly before they expire
+        self.prefetcher = Prefetcher(self.cache, self._prefetch)
+        # Maximum number of queries of a single batch resolved at once
+        self.batch_concurrency = int(os.getenv("DNS_BATCH_CONCURRENCY", 50))
+        # Maximum number of queries of a stream in flight at once
+        self.stream_window = int(os.getenv("DNS_STREAM_WINDOW", 100))
     
     async def lookup(self, domain: str, record_type: str = 'A', dnssec: bool = False) -> Dict[str, Any]:
         """
@@ -24,58 +55,227 @@ class DNSService:
             dnssec: Whether to perform DNSSEC validation
         """
         try:
-            # Configure DNSSEC validation if requested
-            if dnssec:
-                self.resolver.use_dnssec = True
-                self.resolver.want_dnssec = True
-            else:
-                self.resolver.use_dnssec = False
-                self.resolver.want_dnssec = False
-            
-            answers = await self.resolver.resolve(domain, record_type)
-            results = [str(answer) for answer in answers]
-            
-            # Include DNSSEC information if requested and available
-            dnssec_info = {}
-            if dnssec:
-                dnssec_info = self._get_dnssec_info(answers)
-            
-            response = {
+            qname = dns.name.from_text(domain)
+            rdtype = dns.rdatatype.from_text(record_type)
+            entry, cached = await self._query(qname, rdtype, dnssec)
+        except Exception as e:
+            return {
                 "domain": domain,
                 "record_type": record_type,
-                "results": results,
-                "status": "success"
+                "results": [],
+                "status": "error",
+                "error": str(e)
             }
-            
-            # Add DNSSEC info if available
-            if dnssec and dnssec_info:
-                response["dnssec"] = dnssec_info
-            
-            return response
-        except dns.resolver.NXDOMAIN:
-            return {
+        
+        if entry.error_kind == "nxdomain":
+            response = {
                 "domain": domain,
                 "record_type": record_type,
                 "results": [],
                 "status": "error",
                 "error": "Domain does not exist"
             }
-        except dns.resolver.NoAnswer:
-            return {
+        elif entry.error_kind == "noanswer":
+            response = {
                 "domain": domain,
                 "record_type": record_type,
                 "results": [],
                 "status": "error",
                 "error": "No records of the requested type"
             }
-        except Exception as e:
-            return {
+        else:
+            response = {
                 "domain": domain,
                 "record_type": record_type,
-                "results": [],
-                "status": "error",
-                "error": str(e)
+                "results": list(entry.results),
+                "status": "success"
             }
+            
+            # Add DNSSEC info if available
+            if dnssec and entry.dnssec:
+                response["dnssec"] = entry.dnssec
+        
+        response.update(self._cache_info(entry, cached))
+        return response
+    
+    async def wire_lookup(self, wire: bytes) -> Tuple[bytes, int, bool]:
+        """
+        Answer a DNS query message in wire format (RFC 8484)
+        
+        A fresh upstream response is passed back as is, with only the message
+        ID changed to match the query. A response served from the cache has
+        the TTLs of its records lowered to the time it has left, so clients
+        do not keep records past their expiry. DNSSEC records are requested
+        when the query sets the DO bit.
+        
+        Returns the response message, the seconds it may be cached for and
+        whether it was served from the cache. Raises ValueError for a query
+        that cannot be answered.
+        """
+        try:
+            request = dns.message.from_wire(wire)
+        except Exception as e:
+            raise ValueError(f"Invalid DNS message: {e}")
+        
+        if request.opcode() != dns.opcode.QUERY or len(request.question) != 1:
+            raise ValueError("Only standard queries with a single question are supported")
+        question = request.question[0]
+        if question.rdclass != dns.rdataclass.IN:
+            raise ValueError("Only class IN is supported")
+        
+        dnssec = bool(request.ednsflags & dns.flags.DO)
+        try:
+            entry, cached = await self._query(question.name, question.rdtype, dnssec)
+        except Exception as e:
+            logger.warning(f"DNS message query for {question.name} failed: {e}")
+            response = dns.message.make_response(request)
+            response.set_rcode(dns.rcode.SERVFAIL)
+            return response.to_wire(), 0, False
+        
+        ttl = entry.ttl_remaining()
+        if not cached:
+            return request.id.to_bytes(2, "big") + entry.wire[2:], ttl, cached
+        return self._aged_wire(entry.wire, request.id, ttl), ttl, cached
+    
+    @staticmethod
+    def _aged_wire(wire: bytes, message_id: int, ttl: int) -> bytes:
+        """Render a cached response with its ID set and no record TTL above ttl"""
+        response = dns.message.from_wire(wire)
+        response.id = message_id
+        for section in (response.answer, response.authority, response.additional):
+            for rrset in section:
+                rrset.ttl = min(rrset.ttl, ttl)
+        return response.to_wire()
+    
+    async def _query(self, qname: dns.name.Name, rdtype: int, dnssec: bool) -> Tuple[CacheEntry, bool]:
+        """
+        Resolve a query through the answer cache
+        
+        Returns the cache entry and whether it was served from the cache.
+        NXDOMAIN and NoAnswer are returned as negative entries, any other
+        resolution failure is raised.
+        """
+        key = (qname, rdtype, dnssec)
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.prefetcher.record_hit(key)
+            return entry, True
+        
+        return await self.single_flight.do(key, lambda: self._fetch(key))
+    
+    async def _fetch(self, key: Tuple[dns.name.Name, int, bool]) -> Tuple[CacheEntry, bool]:
+        """
+        Resolve an in-process cache miss through the shared cache or upstream
+        and store the result. Returns the entry and whether it came from the
+        shared cache.
+        """
+        qname, rdtype, dnssec = key
+        l2_key = self._l2_key(key)
+        
+        with phase("l2_cache"):
+            entry = await self._fetch_l2(l2_key, qname, rdtype, dnssec)
+        cached = entry is not None
+        if entry is None:
+            with phase("upstream"):
+                entry = await self._resolve(qname, rdtype, dnssec)
+            self.l2_cache.set_behind(l2_key, entry.wire, entry.ttl)
+        
+        self.cache.put(key, entry)
+        return entry, cached
+    
+    @staticmethod
+    def _l2_key(key: Tuple[dns.name.Name, int, bool]) -> str:
+        qname, rdtype, dnssec = key
+        return f"{qname.to_text().lower()}:{rdtype}:{int(dnssec)}"
+    
+    async def _prefetch(self, key: Tuple[dns.name.Name, int, bool]) -> None:
+        """Re-resolve a cached answer upstream ahead of its expiry"""
+        await self.single_flight.do(key, lambda: self._refresh(key))
+    
+    async def _refresh(self, key: Tuple[dns.name.Name, int, bool]) -> Tuple[CacheEntry, bool]:
+        """Resolve upstream and store the result, skipping the shared cache that holds an answer just as old"""
+        qname, rdtype, dnssec = key
+        entry = await self._resolve(qname, rdtype, dnssec)
+        self.l2_cache.set_behind(self._l2_key(key), entry.wire, entry.ttl)
+        self.cache.put(key, entry)
+        return entry, False
+    
+    async def _fetch_l2(self, l2_key: str, qname: dns.name.Name, rdtype: int, dnssec: bool) -> Optional[CacheEntry]:
+        """Build a cache entry from an answer in the shared cache"""
+        cached = await self.l2_cache.get(l2_key)
+        if cached is None:
+            return None
+        
+        wire, ttl = cached
+        try:
+            entry = self._entry_from_response(qname, rdtype, dnssec, dns.message.from_wire(wire))
+        except Exception as e:
+            logger.error(f"Invalid DNS answer in shared cache for {l2_key}: {e}")
+            return None
+        
+        # The shared cache tracks the time left, not the original TTL
+        entry.ttl = math.ceil(ttl)
+        entry.expires_at = time.time() + ttl
+        return entry
+    
+    async def _resolve(self, qname: dns.name.Name, rdtype: int, dnssec: bool) -> CacheEntry:
+        """Resolve a query against the upstream nameservers"""
+        resolver = self.resolvers.get(self.resolvers.profile(dnssec=dnssec))
+        response = await resolver.resolve(qname, rdtype)
+        return self._entry_from_response(qname, rdtype, dnssec, response)
+    
+    def _entry_from_response(
+        self,
+        qname: dns.name.Name,
+        rdtype: int,
+        dnssec: bool,
+        response: dns.message.Message
+    ) -> CacheEntry:
+        """Build a cache entry from an upstream response message"""
+        wire = response.to_wire()
+        
+        if response.rcode() == dns.rcode.NXDOMAIN:
+            return CacheEntry(
+                results=[],
+                wire=wire,
+                ttl=self._negative_ttl(response),
+                error_kind="nxdomain",
+                error="Domain does not exist"
+            )
+        
+        answers = dns.resolver.Answer(qname, rdtype, dns.rdataclass.IN, response)
+        if answers.rrset is None:
+            return CacheEntry(
+                results=[],
+                wire=wire,
+                ttl=self._negative_ttl(response),
+                error_kind="noanswer",
+                error=str(dns.resolver.NoAnswer(response=response))
+            )
+        
+        return CacheEntry(
+            results=[str(answer) for answer in answers],
+            wire=wire,
+            ttl=self.cache.clamp_ttl(answers.chaining_result.minimum_ttl),
+            dnssec=self._get_dnssec_info(answers) if dnssec else None
+        )
+    
+    def _negative_ttl(self, response: dns.message.Message) -> int:
+        """
+        TTL for a negative answer: the lesser of the SOA TTL and the SOA
+        minimum field from the authority section (RFC 2308)
+        """
+        for rrset in response.authority:
+            if rrset.rdtype == dns.rdatatype.SOA and len(rrset):
+                return self.cache.clamp_ttl(min(rrset.ttl, rrset[0].minimum))
+        return self.cache.clamp_ttl(self.cache.negative_ttl)
+    
+    def _cache_info(self, entry: CacheEntry, cached: bool) -> Dict[str, Any]:
+        """Cache status fields added to every resolved response"""
+        return {
+            "cached": cached,
+            "ttl": entry.ttl_remaining()
+        }
     
     def _get_dnssec_info(self, answers) -> Dict[str, Any]:
         """
@@ -109,48 +309,43 @@ class DNSService:
             dnssec: Whether to perform DNSSEC validation
         """
         try:
-            # Configure DNSSEC validation if requested
-            if dnssec:
-                self.resolver.use_dnssec = True
-                self.resolver.want_dnssec = True
-            else:
-                self.resolver.use_dnssec = False
-                self.resolver.want_dnssec = False
-                
             reverse_name = dns.reversename.from_address(ip)
-            answers = await self.resolver.resolve(reverse_name, 'PTR')
-            results = [str(answer) for answer in answers]
-            
-            # Include DNSSEC information if requested and available
-            dnssec_info = {}
-            if dnssec:
-                dnssec_info = self._get_dnssec_info(answers)
-            
-            response = {
+            entry, cached = await self._query(reverse_name, dns.rdatatype.PTR, dnssec)
+        except Exception as e:
+            return {
                 "ip": ip,
-                "domains": results,
-                "status": "success"
+                "domains": [],
+                "status": "error",
+                "error": str(e)
             }
-            
-            # Add DNSSEC info if available
-            if dnssec and dnssec_info:
-                response["dnssec"] = dnssec_info
-                
-            return response
-        except dns.resolver.NXDOMAIN:
-            return {
+        
+        if entry.error_kind == "nxdomain":
+            response = {
                 "ip": ip,
                 "domains": [],
                 "status": "error",
                 "error": "No reverse DNS records found"
             }
-        except Exception as e:
-            return {
+        elif entry.error_kind == "noanswer":
+            response = {
                 "ip": ip,
                 "domains": [],
                 "status": "error",
-                "error": str(e)
+                "error": entry.error
             }
+        else:
+            response = {
+                "ip": ip,
+                "domains": list(entry.results),
+                "status": "success"
+            }
+            
+            # Add DNSSEC info if available
+            if dnssec and entry.dnssec:
+                response["dnssec"] = entry.dnssec
+        
+        response.update(self._cache_info(entry, cached))
+        return response
     
     async def resolve_ptr(self, ip: str, dnssec: bool = False) -> Dict[str, Any]:
         """
@@ -161,4 +356,150 @@ class DNSService:
             dnssec: Whether to perform DNSSEC validation
         """
         # This is essentially the same as reverse_lookup
-        return await self.reverse_lookup(ip, dnssec) 
\ No newline at end of file
+        return await self.reverse_lookup(ip, dnssec)
+    
+    async def batch_lookup(self, items: List[DNSBatchItem], concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Resolve a batch of forward and reverse lookups concurrently
+        
+        Args:
+            items: Queries to resolve
+            concurrency: Maximum number of queries in flight, defaults to DNS_BATCH_CONCURRENCY
+        
+        Returns the results in the same order as the items.
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.batch_concurrency)
+        
+        async def resolve_item(item: DNSBatchItem) -> Dict[str, Any]:
+            async with semaphore:
+                if item.ip is not None:
+                    return await self.reverse_lookup(item.ip, item.dnssec)
+                return await self.lookup(item.domain, item.record_type, item.dnssec)
+        
+        return await asyncio.gather(*(resolve_item(item) for item in items))
+    
+    async def stream_lookup(
+        self,
+        queries: AsyncIterator[Tuple[str, str]],
+        dnssec: bool = False,
+        window: Optional[int] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Resolve a stream of (domain, record_type) queries with a sliding window
+        
+        Results are yielded as soon as each query completes, so they are not
+        in input order. At most `window` queries are in flight or waiting to
+        be consumed; once the window is full no further queries are read from
+        the input, which keeps memory flat for inputs of any size. The last
+        item yielded is a summary with progress and error counts.
+        """
+        window = window or self.stream_window
+        slots = asyncio.Semaphore(window)
+        results: asyncio.Queue = asyncio.Queue(maxsize=window)
+        tasks = set()
+        done = object()
+        summary = {"total": 0, "succeeded": 0, "failed": 0, "cached": 0}
+        
+        async def resolve(domain: str, record_type: str):
+            try:
+                result = await self.lookup(domain, record_type, dnssec)
+                # Blocks while the consumer is behind, holding the slot
+                await results.put(result)
+            finally:
+                slots.release()
+        
+        async def produce():
+            try:
+                async for domain, record_type in queries:
+                    await slots.acquire()
+                    task = asyncio.create_task(resolve(domain, record_type))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            except Exception as e:
+                summary["error"] = str(e)
+            
+            # Wait for every in-flight query to hand over its result
+            for _ in range(window):
+                await slots.acquire()
+            await results.put(done)
+        
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                result = await results.get()
+                if result is done:
+                    break
+                
+                summary["total"] += 1
+                if result.get("status") == "success":
+                    summary["succeeded"] += 1
+                else:
+                    summary["failed"] += 1
+                if result.get("cached"):
+                    summary["cached"] += 1
+                yield result
+            
+            yield {"summary": summary}
+        finally:
+            # Stop reading and resolving if the consumer went away
+            producer.cancel()
+            for task in list(tasks):
+                task.cancel()
+    
+    async def start(self) -> None:
+        """Start background tasks"""
+        await self.upstreams.start()
+        await self.prefetcher.start()
+    
+    async def stop(self) -> None:
+        """Stop background tasks"""
+        await self.prefetcher.stop()
+        await self.upstreams.stop()
+    
+    async def warm_up(self) -> None:
+        """Measure every upstream once so the first queries go to the fastest"""
+        await self.upstreams.probe_all()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Cached answers and upstream statistics, for CacheSnapshot"""
+        now = time.time()
+        return {
+            "cache": [
+                [qname.to_text(), rdtype, dnssec, entry.wire, entry.ttl, entry.expires_at]
+                for (qname, rdtype, dnssec), entry in self.cache.items()
+                if entry.expires_at > now
+            ],
+            "upstreams": self.upstreams.snapshot()
+        }
+    
+    def restore(self, data: Dict[str, Any]) -> int:
+        """Load the unexpired answers and upstream statistics saved by snapshot()"""
+        now = time.time()
+        restored = 0
+        for qname, rdtype, dnssec, wire, ttl, expires_at in data.get("cache", []):
+            if expires_at <= now:
+                continue
+            key = (dns.name.from_text(qname), rdtype, dnssec)
+            try:
+                entry = self._entry_from_response(*key, dns.message.from_wire(wire))
+            except Exception as e:
+                logger.warning(f"Skipping invalid DNS answer in snapshot for {qname}: {e}")
+                continue
+            entry.ttl = ttl
+            entry.expires_at = expires_at
+            self.cache.put(key, entry)
+            restored += 1
+        
+        self.upstreams.restore(data.get("upstreams", {}))
+        return restored
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return DNS service counters"""
+        return {
+            "cache": self.cache.stats(),
+            "l2_cache": self.l2_cache.stats(),
+            "single_flight": self.single_flight.stats(),
+            "prefetch": self.prefetcher.stats(),
+            "upstreams": self.upstreams.stats(),
+            "hedging": self.resolvers.hedging.stats()
+        }
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import dns.rdatatype
+
+from app.services.dns_service import DNSService
+from app.services.whois_service import WhoisService
+
+
+# Record types of a profile when the request does not name any
+DEFAULT_PROFILE_TYPES = ("A", "AAAA", "MX", "NS", "TXT", "CNAME", "SOA", "CAA")
+
+
+def parse_record_types(spec: str) -> List[str]:
+    """
+    Parse comma-separated record types, dropping duplicates
+    Raises ValueError for unknown types.
+    """
+    record_types = []
+    for value in spec.split(","):
+        value = value.strip().upper()
+        if not value or value in record_types:
+            continue
+        try:
+            dns.rdatatype.from_text(value)
+        except dns.rdatatype.UnknownRdatatype:
+            raise ValueError(f"Unknown record type: {value}")
+        record_types.append(value)
+    return record_types
+
+
+class DomainProfileService:
+    """
+    Several record types and optionally WHOIS for one domain, in one request
+
+    All queries start at once and share one deadline, so a profile takes as
+    long as its slowest query rather than the sum of them. Queries still
+    running at the deadline are reported as timed out and the rest is
+    returned; they keep running in the background and fill the caches for
+    the next request.
+    """
+
+    def __init__(self, dns_service: DNSService, whois_service: WhoisService):
+        self.dns_service = dns_service
+        self.whois_service = whois_service
+        # Longest a profile may take, requests can ask for less
+        self.timeout = float(os.getenv("DOMAIN_PROFILE_TIMEOUT", 5))
+        # Requests a WHOIS lookup counts as against the rate limit, each record type counts as one
+        self.whois_cost = int(os.getenv("DOMAIN_PROFILE_WHOIS_COST", 1))
+
+    def cost(self, record_types: List[str], whois: bool) -> int:
+        """Rate limit charge of a profile"""
+        return len(record_types) + (self.whois_cost if whois else 0)
+
+    async def profile(
+        self,
+        domain: str,
+        record_types: List[str],
+        whois: bool = False,
+        dnssec: bool = False,
+        include_raw: bool = False,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Resolve the record types and WHOIS of the domain concurrently
+
+        Returns the result of every record type, the WHOIS result when asked
+        for, and the queries that did not finish within the timeout.
+        """
+        start = time.perf_counter()
+        timeout = min(timeout, self.timeout) if timeout else self.timeout
+
+        tasks = {
+            record_type: asyncio.create_task(self.dns_service.lookup(domain, record_type, dnssec))
+            for record_type in record_types
+        }
+        if whois:
+            tasks["whois"] = asyncio.create_task(self.whois_service.lookup(domain, include_raw=include_raw))
+
+        try:
+            _, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+        results = {}
+        timed_out = []
+        for name, task in tasks.items():
+            if task in pending:
+                timed_out.append(name)
+                results[name] = {"status": "error", "error": f"No answer within {timeout:g} seconds"}
+            else:
+                results[name] = task.result()
+
+        profile = {
+            "domain": domain,
+            "status": "partial" if timed_out else "success",
+            "records": {record_type: results[record_type] for record_type in record_types},
+        }
+        if whois:
+            profile["whois"] = results["whois"]
+        profile["timed_out"] = timed_out
+        profile["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return profile
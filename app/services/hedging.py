@@ -0,0 +1,86 @@
+import os
+from collections import deque
+from typing import Any, Dict, Optional
+
+
+class HedgePolicy:
+    """
+    Decides when a slow upstream query gets a hedge sent to a second upstream
+
+    The hedge delay is either fixed (DNS_HEDGE_DELAY_MS) or the observed
+    DNS_HEDGE_PERCENTILE of recent upstream round trip times. Hedges draw on
+    a budget that grows by DNS_HEDGE_BUDGET per query, so at most that
+    fraction of queries is ever duplicated.
+    """
+
+    # Recent RTTs kept for the percentile
+    SAMPLE_SIZE = 512
+    # Recompute the percentile after this many new samples
+    RECOMPUTE_EVERY = 64
+
+    def __init__(self):
+        self.enabled = os.getenv("DNS_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+        fixed_delay = os.getenv("DNS_HEDGE_DELAY_MS")
+        self.fixed_delay: Optional[float] = float(fixed_delay) / 1000 if fixed_delay else None
+        self.percentile = float(os.getenv("DNS_HEDGE_PERCENTILE", 90))
+        self.min_delay = float(os.getenv("DNS_HEDGE_MIN_DELAY_MS", 10)) / 1000
+        self.budget = float(os.getenv("DNS_HEDGE_BUDGET", 0.1))
+        # Unused budget that may accumulate for bursts of slow queries
+        self.max_tokens = 10.0
+
+        self._samples: deque = deque(maxlen=self.SAMPLE_SIZE)
+        self._new_samples = 0
+        self._observed_delay: Optional[float] = None
+        self._tokens = 0.0
+
+        self.queries = 0
+        self.fired = 0
+        self.won = 0
+        self.over_budget = 0
+
+    def observe(self, rtt: float) -> None:
+        """Record the round trip time of a successful upstream query"""
+        self._samples.append(rtt)
+        self._new_samples += 1
+        if self._new_samples >= self.RECOMPUTE_EVERY or self._observed_delay is None:
+            self._new_samples = 0
+            ordered = sorted(self._samples)
+            index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+            self._observed_delay = ordered[index]
+
+    def delay(self) -> Optional[float]:
+        """
+        Seconds to wait for the first upstream before hedging, or None
+        when hedging is disabled or there is no data to base a delay on yet
+        """
+        if not self.enabled:
+            return None
+        delay = self.fixed_delay if self.fixed_delay is not None else self._observed_delay
+        if delay is None:
+            return None
+        return max(self.min_delay, delay)
+
+    def start_query(self) -> None:
+        """Count a query and add its share to the hedge budget"""
+        self.queries += 1
+        self._tokens = min(self.max_tokens, self._tokens + self.budget)
+
+    def try_hedge(self) -> bool:
+        """Spend budget on a hedge, False if the budget is exhausted"""
+        if self._tokens < 1:
+            self.over_budget += 1
+            return False
+        self._tokens -= 1
+        self.fired += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.delay()
+        return {
+            "enabled": self.enabled,
+            "delay_ms": round(delay * 1000, 2) if delay is not None else None,
+            "queries": self.queries,
+            "fired": self.fired,
+            "won": self.won,
+            "over_budget": self.over_budget,
+        }
@@ -0,0 +1,88 @@
+import asyncio
+import os
+from typing import Any, Dict, Optional, Set, Tuple
+
+from loguru import logger
+
+from app.services.redis_pool import get_redis
+
+
+def l2_cache_enabled() -> bool:
+    """Whether the shared Redis result cache is turned on"""
+    return os.getenv("L2_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+
+
+class RedisResultCache:
+    """
+    Second-level result cache shared by every worker through Redis
+
+    Values are opaque bytes stored with an expiry, so a lookup made by one
+    worker can be served to every other worker until it expires. Reads go
+    through the cache; writes are done in the background so they never add
+    latency to the request that populated them. Redis errors count as misses.
+    """
+
+    def __init__(self, namespace: str, enabled: Optional[bool] = None):
+        self.namespace = namespace
+        self.enabled = l2_cache_enabled() if enabled is None else enabled
+        self._pending_writes: Set[asyncio.Task] = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def _key(self, key: str) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """Return the cached value and its remaining TTL in seconds, or None on a miss"""
+        if not self.enabled:
+            return None
+
+        try:
+            async with get_redis(binary=True).pipeline(transaction=False) as pipe:
+                pipe.get(self._key(key))
+                pipe.pttl(self._key(key))
+                value, ttl_ms = await pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            self.misses += 1
+            logger.debug(f"L2 cache read error ({self.namespace}): {e}")
+            return None
+
+        if value is None or ttl_ms <= 0:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value, ttl_ms / 1000
+
+    def set_behind(self, key: str, value: bytes, ttl: float) -> None:
+        """Store a value in the background, expiring after ttl seconds"""
+        if not self.enabled or ttl <= 0:
+            return
+
+        task = asyncio.create_task(self._set(key, value, ttl))
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+
+    async def _set(self, key: str, value: bytes, ttl: float) -> None:
+        try:
+            await get_redis(binary=True).set(self._key(key), value, px=max(1, int(ttl * 1000)))
+            self.writes += 1
+        except Exception as e:
+            self.errors += 1
+            logger.debug(f"L2 cache write error ({self.namespace}): {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cache counters"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
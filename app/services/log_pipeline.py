@@ -0,0 +1,211 @@
+import atexit
+import copy
+import os
+import queue
+import random
+import sys
+import threading
+import traceback
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import orjson
+from loguru import logger
+
+from app.services.metrics import Counter, Metric
+
+
+# Line format of text logs
+TEXT_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}"
+
+# Records at this level or above are never sampled out
+WARNING_LEVEL = 30
+
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """Parse "category=rate,..." into {category: rate}"""
+    rates = {}
+    for item in spec.split(","):
+        category, sep, rate = item.partition("=")
+        if sep and category.strip():
+            rates[category.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class LogPipeline:
+    """
+    Sets up the log sinks of the worker: stdout and logs/api.log
+
+    LOG_FORMAT selects text lines or compact JSON lines, which carry the
+    fields bound to the logger. Records are sampled per category, given with
+    logger.bind(category=...): LOG_SAMPLING keeps that fraction of the INFO
+    records of each category, warnings and errors are always kept. With
+    LOG_ASYNC, records are handed to a writer thread over a queue of
+    LOG_QUEUE_SIZE records, so formatting and file I/O leave the event
+    loop; when the queue is full records are dropped and counted instead
+    of blocking.
+    """
+
+    def __init__(self):
+        self.format = os.getenv("LOG_FORMAT", "text").lower()
+        self.use_async = os.getenv("LOG_ASYNC", "false").lower() in ("1", "true", "yes")
+        self.queue_size = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+        self.sampling = parse_sampling(os.getenv("LOG_SAMPLING", ""))
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.failed = 0
+        self._reported_drops = 0
+        self._reported_failures = 0
+
+    def configure(self) -> None:
+        """Replace the default loguru sink with the configured pipeline"""
+        logger.remove()
+        if self.use_async:
+            # An independent logger owns the real sinks and is only used by the writer thread
+            output = copy.deepcopy(logger)
+            # Sink errors reach the writer thread, which counts them
+            self._add_sinks(output, "{message}", catch=False)
+            self._queue = queue.Queue(self.queue_size)
+            self._thread = threading.Thread(target=self._write_loop, args=(output,), name="log-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+            logger.add(self._enqueue, level="INFO", format="{message}", filter=self._keep)
+        elif self.format == "json":
+            self._add_sinks(logger, self._json_format)
+        else:
+            self._add_sinks(logger, TEXT_FORMAT)
+        logger.configure(patcher=self._sample)
+
+    def _add_sinks(self, target: Any, format: Any, catch: bool = True) -> None:
+        target.add(sys.stdout, format=format, level="INFO", filter=self._keep, catch=catch)
+        target.add(
+            "logs/api.log",
+            rotation="500 MB",
+            retention="10 days",
+            format=format,
+            level="INFO",
+            filter=self._keep,
+            catch=catch,
+        )
+
+    def _sample(self, record: Dict[str, Any]) -> None:
+        """Decide once per record whether it is kept, so every sink agrees"""
+        keep = True
+        if record["level"].no < WARNING_LEVEL:
+            rate = self.sampling.get(record["extra"].get("category", "app"), 1.0)
+            if rate < 1.0 and random.random() >= rate:
+                keep = False
+                self.sampled_out += 1
+        record["extra"]["_keep"] = keep
+
+    @staticmethod
+    def _keep(record: Dict[str, Any]) -> bool:
+        return record["extra"].get("_keep", True)
+
+    def render(self, record: Dict[str, Any]) -> str:
+        """Format a record as a text or JSON line, without the newline"""
+        exception = record["exception"]
+        if self.format != "json":
+            line = f"{record['time']:%Y-%m-%d %H:%M:%S} | {record['level'].name} | {record['message']}"
+            if exception is not None:
+                line += "\n" + "".join(traceback.format_exception(*exception)).rstrip("\n")
+            return line
+
+        entry = {
+            "time": record["time"].isoformat(),
+            "level": record["level"].name,
+            "category": record["extra"].get("category", "app"),
+            "message": record["message"],
+        }
+        for key, value in record["extra"].items():
+            if not key.startswith("_"):
+                entry.setdefault(key, value)
+        if exception is not None:
+            entry["exception"] = "".join(traceback.format_exception(*exception))
+        return orjson.dumps(entry, default=str).decode()
+
+    def _notice(self, message: str) -> str:
+        """A warning line written by the writer thread itself"""
+        now = datetime.now().astimezone()
+        if self.format != "json":
+            return f"{now:%Y-%m-%d %H:%M:%S} | WARNING | {message}"
+        return orjson.dumps({"time": now.isoformat(), "level": "WARNING", "category": "app", "message": message}).decode()
+
+    def _json_format(self, record: Dict[str, Any]) -> str:
+        record["extra"]["_line"] = self.render(record)
+        return "{extra[_line]}\n"
+
+    def _enqueue(self, message: Any) -> None:
+        """Sink of the event loop side, never blocks"""
+        try:
+            self._queue.put_nowait(message.record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self, output: Any) -> None:
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            try:
+                output.opt(raw=True).log(record["level"].name, self.render(record) + "\n")
+                self.written += 1
+            except Exception:
+                self.failed += 1
+                continue
+            self._report(output)
+
+    def _report(self, output: Any) -> None:
+        """Write one notice for the records dropped or failed since the last one"""
+        messages = []
+        if self.dropped > self._reported_drops:
+            dropped, self._reported_drops = self.dropped - self._reported_drops, self.dropped
+            messages.append(f"Dropped {dropped} log records, the log queue was full")
+        if self.failed > self._reported_failures:
+            failed, self._reported_failures = self.failed - self._reported_failures, self.failed
+            messages.append(f"Failed to write {failed} log records")
+        for message in messages:
+            try:
+                output.opt(raw=True).warning(self._notice(message) + "\n")
+            except Exception:
+                pass
+
+    def stop(self) -> None:
+        """Flush queued records and stop the writer thread"""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=5)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return logging counters"""
+        return {
+            "async": self.use_async,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+            "failed": self.failed,
+        }
+
+    def metrics(self) -> List[Metric]:
+        """Collector for the Prometheus metrics"""
+        dropped = Counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+        dropped.set(self.dropped)
+        sampled_out = Counter("log_records_sampled_out_total", "Log records left out by sampling")
+        sampled_out.set(self.sampled_out)
+        failed = Counter("log_records_failed_total", "Log records the writer thread failed to write")
+        failed.set(self.failed)
+        return [dropped, sampled_out, failed]
+
+
+# Logging of this worker, configured on startup
+log_pipeline = LogPipeline()
@@ -0,0 +1,295 @@
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+
+# Latency buckets in seconds, from cache hits to slow WHOIS servers
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metric:
+    """
+    A metric family, with one value per combination of label values
+
+    Values are plain Python numbers updated from the event loop, so
+    recording a sample takes no lock and no I/O.
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """The family and its current values, msgpack friendly"""
+        return {
+            "type": self.type,
+            "help": self.documentation,
+            "labels": list(self.labels),
+            "samples": [[list(labels), value] for labels, value in self._values.items()],
+        }
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, value: float, *labels: str) -> None:
+        """Set the value, for collectors mirroring counts kept elsewhere"""
+        self._values[labels] = value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._values.get(labels)
+        if series is None:
+            # A count per bucket, the last bucket being +Inf, followed by the sum
+            series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = super().snapshot()
+        snapshot["buckets"] = list(self.buckets)
+        snapshot["samples"] = [[labels, list(series)] for labels, series in snapshot["samples"]]
+        return snapshot
+
+
+class MetricsRegistry:
+    """
+    The metrics of a worker
+
+    Collectors are called on every snapshot and return metrics built from
+    counters the services already keep, so those cost nothing per request.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Metric]]] = []
+
+    def _register(self, metric: Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[Metric]]) -> None:
+        self._collectors.append(collector)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Current values of every metric, keyed by name"""
+        metrics = list(self._metrics.values())
+        for collector in self._collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+def merge_snapshots(snapshots: Iterable[Tuple[Dict[str, Dict[str, Any]], bool]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Sum the snapshots of several workers, given with whether each worker is alive
+
+    Gauges of workers that are gone are left out. Their counters and
+    histograms are kept, so totals do not go backwards when a worker is
+    replaced.
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    for snapshot, alive in snapshots:
+        for name, family in snapshot.items():
+            if family["type"] == "gauge" and not alive:
+                continue
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = {**family, "samples": {}}
+            samples = target["samples"]
+            for labels, value in family["samples"]:
+                labels = tuple(labels)
+                current = samples.get(labels)
+                if current is None:
+                    samples[labels] = value
+                elif isinstance(value, list):
+                    # Workers of different versions may use different buckets
+                    if len(value) == len(current):
+                        samples[labels] = [a + b for a, b in zip(current, value)]
+                else:
+                    samples[labels] = current + value
+    return merged
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(pairs: List[Tuple[str, Any]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def render(merged: Dict[str, Dict[str, Any]]) -> str:
+    """Prometheus text exposition format (version 0.0.4) of merged snapshots"""
+    lines = []
+    for name, family in sorted(merged.items()):
+        documentation = family["help"].replace("\\", "\\\\").replace("\n", "\\n")
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for labels, value in sorted(family["samples"].items()):
+            pairs = list(zip(family["labels"], labels))
+            if family["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(pairs)} {_format_value(value)}")
+                continue
+            count = 0
+            for bound, bucket in zip([*family["buckets"], float("inf")], value[:-1]):
+                count += bucket
+                lines.append(f"{name}_bucket{_format_labels(pairs + [('le', _format_value(float(bound)))])} {count}")
+            lines.append(f"{name}_sum{_format_labels(pairs)} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{_format_labels(pairs)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+class Observation:
+    """Outcome of an observed call, set by the caller when it is not a success"""
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = "success"
+
+
+@contextmanager
+def observe(histogram: Histogram, in_flight: Optional[Gauge], *labels: str) -> Iterator[Observation]:
+    """
+    Time a call into a histogram labelled with `labels` and its outcome,
+    counting it in the `in_flight` gauge (labelled with `labels`) meanwhile
+    """
+    observation = Observation()
+    if in_flight is not None:
+        in_flight.inc(*labels)
+    start = time.perf_counter()
+    try:
+        yield observation
+    except asyncio.CancelledError:
+        observation.outcome = "cancelled"
+        raise
+    except BaseException:
+        if observation.outcome == "success":
+            observation.outcome = "error"
+        raise
+    finally:
+        if in_flight is not None:
+            in_flight.dec(*labels)
+        histogram.observe(time.perf_counter() - start, *labels, observation.outcome)
+
+
+def cache_collector(caches: Dict[str, Any]) -> Callable[[], List[Metric]]:
+    """Collector exposing the counters of caches that have a stats() method"""
+    def collect() -> List[Metric]:
+        hits = Counter("cache_hits_total", "Lookups answered from the cache", ["cache"])
+        misses = Counter("cache_misses_total", "Lookups not found in the cache", ["cache"])
+        evictions = Counter("cache_evictions_total", "Entries evicted to make room", ["cache"])
+        entries = Gauge("cache_entries", "Entries held in the cache", ["cache"])
+        for name, cache in caches.items():
+            stats = cache.stats()
+            hits.set(stats["hits"], name)
+            misses.set(stats["misses"], name)
+            if "evictions" in stats:
+                evictions.set(stats["evictions"], name)
+            if "entries" in stats:
+                entries.set(stats["entries"], name)
+        return [hits, misses, evictions, entries]
+    return collect
+
+
+# Metrics of this worker
+registry = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds",
+    "Time to serve a request, until the last byte of the response",
+    ["method", "route", "status"]
+)
+HTTP_REQUESTS_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight",
+    "Requests being served"
+)
+DNS_UPSTREAM_DURATION = registry.histogram(
+    "dns_upstream_query_duration_seconds",
+    "Time for an upstream nameserver to answer a query",
+    ["upstream", "outcome"]
+)
+DNS_UPSTREAM_IN_FLIGHT = registry.gauge(
+    "dns_upstream_queries_in_flight",
+    "Queries waiting for an upstream nameserver",
+    ["upstream"]
+)
+WHOIS_QUERY_DURATION = registry.histogram(
+    "whois_query_duration_seconds",
+    "Time for a WHOIS or RDAP server to answer a query, after waiting for its throttle",
+    ["server", "backend", "outcome"]
+)
+WHOIS_IN_FLIGHT = registry.gauge(
+    "whois_queries_in_flight",
+    "Queries waiting for a WHOIS or RDAP server",
+    ["server", "backend"]
+)
+REDIS_COMMAND_DURATION = registry.histogram(
+    "redis_command_duration_seconds",
+    "Round trip time of Redis commands and pipelines",
+    ["command", "outcome"]
+)
+RATE_LIMIT_CHECK_DURATION = registry.histogram(
+    "rate_limit_check_duration_seconds",
+    "Time to check a request against its rate limit, by whether it was allowed",
+    ["result"]
+)
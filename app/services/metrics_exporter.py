@@ -0,0 +1,112 @@
+import asyncio
+import os
+import socket
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import msgpack
+from loguru import logger
+
+from app.services.metrics import MetricsRegistry, merge_snapshots, render
+from app.services.redis_pool import get_redis
+
+
+# Content type of the Prometheus text exposition format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsExporter:
+    """
+    Serves the metrics of every worker of the host in the Prometheus format
+
+    Each worker records its metrics in process. Every
+    METRICS_PUBLISH_INTERVAL seconds it publishes a snapshot to a Redis hash
+    shared by the workers of the host, and a scrape of any worker adds its
+    own current metrics to the snapshots of the others. Workers that stop
+    publishing lose their gauges right away, their counters and histograms
+    are kept for METRICS_RETENTION seconds.
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self.interval = float(os.getenv("METRICS_PUBLISH_INTERVAL", 5))
+        self.retention = int(os.getenv("METRICS_RETENTION", 86400))
+        self.key = f"metrics:{socket.gethostname()}"
+        self.worker_id = str(os.getpid())
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def shared(self) -> bool:
+        return self.interval > 0
+
+    async def publish(self) -> None:
+        """Publish this worker's metrics for the other workers"""
+        data = msgpack.packb({"updated_at": time.time(), "metrics": self.registry.snapshot()}, use_bin_type=True)
+        try:
+            async with get_redis(binary=True).pipeline(transaction=False) as pipe:
+                pipe.hset(self.key, self.worker_id, data)
+                pipe.expire(self.key, self.retention)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to publish metrics: {e}")
+
+    async def _worker_snapshots(self) -> List[Tuple[Dict[str, Any], bool]]:
+        """Snapshots published by the other workers, with whether each worker is alive"""
+        try:
+            workers = await get_redis(binary=True).hgetall(self.key)
+        except Exception as e:
+            logger.error(f"Failed to read the metrics of other workers: {e}")
+            return []
+
+        now = time.time()
+        snapshots = []
+        expired = []
+        for worker_id, data in workers.items():
+            if worker_id.decode() == self.worker_id:
+                continue
+            try:
+                worker = msgpack.unpackb(data, raw=False)
+                age = now - worker["updated_at"]
+            except Exception:
+                expired.append(worker_id)
+                continue
+            if age > self.retention:
+                expired.append(worker_id)
+                continue
+            # A worker is gone once it missed a few publications
+            snapshots.append((worker["metrics"], age <= 3 * self.interval))
+
+        if expired:
+            try:
+                await get_redis(binary=True).hdel(self.key, *expired)
+            except Exception as e:
+                logger.error(f"Failed to remove expired worker metrics: {e}")
+        return snapshots
+
+    async def render(self) -> str:
+        """Metrics of every worker of the host, in the Prometheus text format"""
+        snapshots = [(self.registry.snapshot(), True)]
+        if self.shared:
+            snapshots.extend(await self._worker_snapshots())
+        return render(merge_snapshots(snapshots))
+
+    async def start(self) -> None:
+        """Start publishing this worker's metrics in the background"""
+        if self.shared and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Stop publishing, after a final publication"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.publish()
+
+    async def _loop(self) -> None:
+        while True:
+            await self.publish()
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from loguru import logger
+
+from app.services.dns_cache import CacheKey, DNSCache
+
+
+class Prefetcher:
+    """
+    Refresh-ahead for popular cached DNS answers
+
+    Cache hits are counted per key. A background task re-resolves entries
+    that were hit at least DNS_PREFETCH_MIN_HITS times since they were
+    last resolved once they pass DNS_PREFETCH_THRESHOLD of their TTL, so
+    hot names are replaced before they expire and never miss. Refreshes
+    run at most DNS_PREFETCH_CONCURRENCY at a time and are limited to
+    DNS_PREFETCH_QPS overall, hottest names first.
+    """
+
+    def __init__(self, cache: DNSCache, refresh: Callable[[CacheKey], Awaitable[Any]]):
+        self.cache = cache
+        self.refresh = refresh
+        self.enabled = os.getenv("DNS_PREFETCH_ENABLED", "false").lower() in ("1", "true", "yes")
+        # Fraction of the TTL after which a popular entry is refreshed
+        self.threshold = float(os.getenv("DNS_PREFETCH_THRESHOLD", 0.8))
+        self.min_hits = int(os.getenv("DNS_PREFETCH_MIN_HITS", 3))
+        self.concurrency = int(os.getenv("DNS_PREFETCH_CONCURRENCY", 10))
+        self.qps = float(os.getenv("DNS_PREFETCH_QPS", 50))
+        self.interval = float(os.getenv("DNS_PREFETCH_INTERVAL", 1))
+        # Keys tracked at once, further keys are ignored until some expire
+        self.max_tracked = int(os.getenv("DNS_PREFETCH_MAX_TRACKED", 10000))
+
+        self._hits: Dict[CacheKey, int] = {}
+        self._refreshing: Set[CacheKey] = set()
+        # Running refreshes, referenced so they are not garbage collected
+        self._refresh_tasks: Set[asyncio.Task] = set()
+        self._tokens = self.qps
+        self._task: Optional[asyncio.Task] = None
+
+        self.refreshed = 0
+        self.failed = 0
+        self.over_budget = 0
+
+    def record_hit(self, key: CacheKey) -> None:
+        """Count a cache hit for a key"""
+        if not self.enabled:
+            return
+        hits = self._hits.get(key)
+        if hits is not None:
+            self._hits[key] = hits + 1
+        elif len(self._hits) < self.max_tracked:
+            self._hits[key] = 1
+
+    async def start(self) -> None:
+        """Start refreshing in the background"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Stop scheduling and cancel refreshes in flight"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        tasks = list(self._refresh_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self._tokens = min(self.qps, self._tokens + self.qps * self.interval)
+            try:
+                self._schedule()
+            except Exception as e:
+                logger.error(f"DNS prefetch error: {e}")
+
+    def _schedule(self) -> None:
+        """Start refreshes for the popular entries that are due, hottest first"""
+        now = time.time()
+        due = []
+        for key, hits in list(self._hits.items()):
+            entry = self.cache.peek(key)
+            if entry is None or entry.expires_at <= now:
+                del self._hits[key]
+                continue
+            if key in self._refreshing or entry.ttl <= 0:
+                continue
+            if (entry.expires_at - now) / entry.ttl > 1 - self.threshold:
+                continue
+            if hits < self.min_hits:
+                # Not popular enough, let it expire
+                del self._hits[key]
+                continue
+            due.append((hits, key))
+
+        due.sort(key=lambda item: item[0], reverse=True)
+        for _, key in due:
+            if len(self._refreshing) >= self.concurrency:
+                break
+            if self._tokens < 1:
+                self.over_budget += 1
+                break
+            self._tokens -= 1
+            self._refreshing.add(key)
+            task = asyncio.create_task(self._refresh(key))
+            self._refresh_tasks.add(task)
+            task.add_done_callback(self._refresh_tasks.discard)
+
+    async def _refresh(self, key: CacheKey) -> None:
+        try:
+            await self.refresh(key)
+            self.refreshed += 1
+            # The fresh entry has to earn its next refresh
+            if key in self._hits:
+                self._hits[key] = 0
+        except Exception as e:
+            self.failed += 1
+            logger.debug(f"DNS prefetch of {key[0]} failed: {e}")
+        finally:
+            self._refreshing.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return prefetch counters"""
+        return {
+            "enabled": self.enabled,
+            "tracked": len(self._hits),
+            "in_flight": len(self._refreshing),
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+            "over_budget": self.over_budget,
+        }
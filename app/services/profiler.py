@@ -0,0 +1,95 @@
+import asyncio
+import os
+import sys
+import threading
+from collections import Counter
+from types import FrameType
+from typing import Dict, Optional
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is being taken"""
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for the event loop of this worker
+
+    While a profile is taken, a background thread looks at the stack of the
+    event loop thread at a fixed interval and counts every distinct stack.
+    The loop keeps serving requests meanwhile, which is what gets sampled.
+    Samples taken while the loop waits for I/O are left out unless asked
+    for. Profiles last at most PROFILER_MAX_SECONDS.
+    """
+
+    def __init__(self):
+        self.max_seconds = float(os.getenv("PROFILER_MAX_SECONDS", 60))
+        self._running = False
+        self._paths: Dict[str, str] = {}
+
+    async def profile(self, seconds: float, interval: float = 0.005, include_idle: bool = False) -> Dict[str, int]:
+        """Sample the event loop for `seconds`, returning sample counts per collapsed stack"""
+        if self._running:
+            raise ProfilerBusy("A profile is already being taken")
+
+        self._running = True
+        stacks: Counter = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample,
+            args=(threading.get_ident(), interval, include_idle, stacks, stop),
+            name="profiler",
+            daemon=True
+        )
+        sampler.start()
+        try:
+            await asyncio.sleep(min(seconds, self.max_seconds))
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+            self._running = False
+        return dict(stacks)
+
+    def _sample(self, thread_id: int, interval: float, include_idle: bool, stacks: Counter, stop: threading.Event) -> None:
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                return
+            if not include_idle and self._idle(frame):
+                continue
+            stacks[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _idle(frame: FrameType) -> bool:
+        """Whether the loop is waiting in its selector for I/O or timers"""
+        return frame.f_code.co_name == "select" and frame.f_code.co_filename.endswith("selectors.py")
+
+    def _collapse(self, frame: Optional[FrameType]) -> str:
+        """Stack as "outer;...;inner" frames, each "function (file:line)" """
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({self._short_path(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _short_path(self, path: str) -> str:
+        """Path relative to the package directory or the working directory"""
+        short = self._paths.get(path)
+        if short is None:
+            short = path
+            for marker in ("site-packages/", "dist-packages/"):
+                if marker in path:
+                    short = path.rsplit(marker, 1)[1]
+                    break
+            else:
+                cwd = os.getcwd() + os.sep
+                if path.startswith(cwd):
+                    short = path[len(cwd):]
+            self._paths[path] = short
+        return short
+
+
+def collapsed_stacks(stacks: Dict[str, int]) -> str:
+    """Collapsed stack format, one "frame;frame;frame count" line per stack, as read by flamegraph.pl"""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
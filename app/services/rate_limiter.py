@@ -0,0 +1,361 @@
+import asyncio
+import math
+from abc import ABC, abstractmethod
+import os
+import time
+import uuid
+from typing import Dict, Optional, Set
+
+from loguru import logger
+
+from app.services.redis_pool import get_redis
+
+
+# Length of the rate limit window in seconds: limits are "requests per minute"
+RATE_LIMIT_PERIOD = 60
+
+
+class RateLimitResult:
+    """Outcome of a rate limit check"""
+    __slots__ = ("allowed", "limit", "remaining", "reset_after", "retry_after")
+
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset_after: float, retry_after: float = 0.0):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        # Seconds until the full quota is available again
+        self.reset_after = reset_after
+        # Seconds until a denied request would be allowed
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        """X-RateLimit-* headers for this result, plus Retry-After when denied"""
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(max(0, self.remaining)),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+class RateLimiter(ABC):
+    """Base class for rate limiter engines"""
+
+    @abstractmethod
+    async def hit(self, key: str, limit: int, cost: int = 1) -> RateLimitResult:
+        """Charge cost requests against the key's per-minute limit"""
+
+    @abstractmethod
+    async def refund(self, key: str, limit: int, cost: int) -> None:
+        """Give back cost requests charged by an earlier hit that were never made"""
+
+    async def stop(self) -> None:
+        """Release anything the limiter holds for this worker"""
+
+
+class GCRARateLimiter(RateLimiter):
+    """
+    Generic Cell Rate Algorithm in a single Redis script call
+
+    Each key stores only its theoretical arrival time (TAT). Requests are
+    spaced by period / limit, and a burst of up to `limit` requests is
+    allowed. The script uses the Redis clock, so every worker agrees on time.
+    """
+
+    SCRIPT = """
+local key = KEYS[1]
+local emission = tonumber(ARGV[1])
+local burst_offset = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+
+local tat = tonumber(redis.call('GET', key))
+if not tat or tat < now then
+    tat = now
+end
+
+local new_tat = tat + emission * cost
+local allow_at = new_tat - burst_offset
+local diff = now - allow_at
+
+if diff < 0 then
+    local remaining = math.floor((now - (tat - burst_offset)) / emission)
+    return {0, remaining, tat - now, -diff}
+end
+
+redis.call('SET', key, new_tat, 'PX', math.ceil(new_tat - now))
+return {1, math.floor(diff / emission), new_tat - now, 0}
+"""
+
+    # Moves the TAT back by the refunded requests; a TAT in the past means a full burst
+    REFUND_SCRIPT = """
+local key = KEYS[1]
+local emission = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+
+local tat = tonumber(redis.call('GET', key))
+if not tat then
+    return 0
+end
+
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+
+local new_tat = tat - emission * cost
+if new_tat <= now then
+    redis.call('DEL', key)
+else
+    redis.call('SET', key, new_tat, 'PX', math.ceil(new_tat - now))
+end
+return 1
+"""
+
+    def __init__(self):
+        self._script = None
+        self._refund_script = None
+
+    async def hit(self, key: str, limit: int, cost: int = 1) -> RateLimitResult:
+        if self._script is None:
+            self._script = get_redis().register_script(self.SCRIPT)
+
+        # Times are in milliseconds
+        emission = RATE_LIMIT_PERIOD * 1000 / max(1, limit)
+        burst_offset = emission * limit
+        allowed, remaining, reset_after, retry_after = await self._script(
+            keys=[f"rate_limit:gcra:{key}"],
+            args=[emission, burst_offset, cost],
+        )
+        return RateLimitResult(
+            allowed=bool(allowed),
+            limit=limit,
+            remaining=int(remaining),
+            reset_after=int(reset_after) / 1000,
+            retry_after=int(retry_after) / 1000,
+        )
+
+    async def refund(self, key: str, limit: int, cost: int) -> None:
+        if self._refund_script is None:
+            self._refund_script = get_redis().register_script(self.REFUND_SCRIPT)
+
+        emission = RATE_LIMIT_PERIOD * 1000 / max(1, limit)
+        await self._refund_script(keys=[f"rate_limit:gcra:{key}"], args=[emission, cost])
+
+
+class SlidingWindowRateLimiter(RateLimiter):
+    """
+    Sliding window log in a sorted set, checked and updated in one Redis script call
+
+    Allowed requests are recorded as members of the window; a denied request
+    records nothing, so a denied lease or batch does not use up quota.
+    """
+
+    SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window_start = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local request_id = ARGV[5]
+local ttl = tonumber(ARGV[6])
+
+redis.call('ZREMRANGEBYSCORE', key, 0, window_start)
+local count = redis.call('ZCARD', key)
+local allowed = 0
+if count + cost <= limit then
+    allowed = 1
+    -- One unique member per counted request, added in chunks to stay within Lua's stack
+    local members = {}
+    for i = 1, cost do
+        members[#members + 1] = ARGV[1]
+        members[#members + 1] = ARGV[1] .. ':' .. request_id .. ':' .. i
+        if #members >= 1000 or i == cost then
+            redis.call('ZADD', key, unpack(members))
+            members = {}
+        end
+    end
+    count = count + cost
+    redis.call('EXPIRE', key, ttl)
+end
+
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+return {allowed, count, oldest[2] or ARGV[1]}
+"""
+
+    def __init__(self):
+        self._script = None
+
+    async def hit(self, key: str, limit: int, cost: int = 1) -> RateLimitResult:
+        if self._script is None:
+            self._script = get_redis().register_script(self.SCRIPT)
+
+        current_time = time.time()
+        allowed, request_count, oldest_time = await self._script(
+            keys=[f"rate_limit:{key}"],
+            args=[
+                repr(current_time),
+                repr(current_time - RATE_LIMIT_PERIOD),
+                limit,
+                cost,
+                uuid.uuid4().hex,
+                RATE_LIMIT_PERIOD * 2,
+            ],
+        )
+
+        reset_after = max(0.0, float(oldest_time) + RATE_LIMIT_PERIOD - current_time)
+        allowed = bool(allowed)
+        return RateLimitResult(
+            allowed=allowed,
+            limit=limit,
+            remaining=limit - int(request_count),
+            reset_after=reset_after,
+            retry_after=0.0 if allowed else reset_after,
+        )
+
+    async def refund(self, key: str, limit: int, cost: int) -> None:
+        # Drops the newest entries, which are the refunded ones unless other
+        # requests came in since, in which case the window frees up slightly early
+        await get_redis().zremrangebyrank(f"rate_limit:{key}", -cost, -1)
+
+
+class _Lease:
+    __slots__ = ("tokens", "expires_at", "result", "expiry")
+
+    def __init__(self, tokens: int, expires_at: float, result: RateLimitResult, expiry: asyncio.TimerHandle):
+        self.tokens = tokens
+        self.expires_at = expires_at
+        self.result = result
+        # Refunds the unused tokens when the lease expires
+        self.expiry = expiry
+
+
+class LeasedRateLimiter(RateLimiter):
+    """
+    Serve most requests from a quota slice reserved by this worker
+
+    When a key has no usable lease, the worker reserves `fraction` of the
+    key's limit from the shared engine in one call and spends it locally.
+    Tokens still unused when the lease expires or is replaced are refunded,
+    so a key is only charged for the requests it made. While a lease is
+    held its unused tokens are not available to other workers, which can
+    deny a key close to its limit early. It pays off for keys with high limits.
+    """
+
+    def __init__(self, engine: RateLimiter, fraction: float, lease_ttl: float):
+        self.engine = engine
+        self.fraction = fraction
+        self.lease_ttl = lease_ttl
+        self._leases: Dict[str, _Lease] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._refunds: Set[asyncio.Task] = set()
+
+        self.local_hits = 0
+        self.leases = 0
+        self.refunded_tokens = 0
+
+    async def hit(self, key: str, limit: int, cost: int = 1) -> RateLimitResult:
+        result = self._take(key, limit, cost)
+        if result is not None:
+            return result
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Another request may have renewed the lease meanwhile
+            result = self._take(key, limit, cost)
+            if result is not None:
+                return result
+
+            # Give back what is left of an expired or used up lease before taking the next
+            lease = self._leases.pop(key, None)
+            if lease is not None:
+                lease.expiry.cancel()
+                await self._refund(key, lease)
+
+            lease_size = int(limit * self.fraction)
+            if lease_size > cost:
+                result = await self.engine.hit(key, limit, lease_size)
+                if result.allowed:
+                    self.leases += 1
+                    expiry = asyncio.get_running_loop().call_later(self.lease_ttl, self._expire, key)
+                    self._leases[key] = _Lease(lease_size - cost, time.monotonic() + self.lease_ttl, result, expiry)
+                    return self._leased_result(self._leases[key], limit)
+
+            # Not enough quota left for a lease, charge this request alone
+            return await self.engine.hit(key, limit, cost)
+
+    def _take(self, key: str, limit: int, cost: int) -> Optional[RateLimitResult]:
+        lease = self._leases.get(key)
+        if lease is None or lease.expires_at <= time.monotonic() or lease.tokens < cost:
+            return None
+        lease.tokens -= cost
+        self.local_hits += 1
+        return self._leased_result(lease, limit)
+
+    def _leased_result(self, lease: _Lease, limit: int) -> RateLimitResult:
+        # Unused lease tokens are spent here or refunded, so they still count as remaining
+        return RateLimitResult(
+            allowed=True,
+            limit=limit,
+            remaining=lease.result.remaining + lease.tokens,
+            reset_after=lease.result.reset_after,
+        )
+
+    def _expire(self, key: str) -> None:
+        lease = self._leases.pop(key, None)
+        lock = self._locks.get(key)
+        if lock is not None and not lock.locked():
+            del self._locks[key]
+        if lease is not None and lease.tokens:
+            task = asyncio.create_task(self._refund(key, lease))
+            self._refunds.add(task)
+            task.add_done_callback(self._refunds.discard)
+
+    async def _refund(self, key: str, lease: _Lease) -> None:
+        tokens, lease.tokens = lease.tokens, 0
+        if not tokens:
+            return
+        try:
+            await self.engine.refund(key, lease.result.limit, tokens)
+            self.refunded_tokens += tokens
+        except Exception as e:
+            logger.warning(f"Failed to refund {tokens} leased rate limit tokens: {e}")
+
+    async def refund(self, key: str, limit: int, cost: int) -> None:
+        await self.engine.refund(key, limit, cost)
+
+    async def stop(self) -> None:
+        """Refund the unused tokens of every lease"""
+        leases, self._leases = self._leases, {}
+        for lease in leases.values():
+            lease.expiry.cancel()
+        await asyncio.gather(
+            *self._refunds,
+            *(self._refund(key, lease) for key, lease in leases.items()),
+            return_exceptions=True,
+        )
+
+
+ENGINES = {
+    "gcra": GCRARateLimiter,
+    "sliding_window": SlidingWindowRateLimiter,
+}
+
+
+def create_rate_limiter() -> RateLimiter:
+    """Create the rate limiter engine configured in the environment"""
+    algorithm = os.getenv("RATE_LIMIT_ALGORITHM", "gcra").lower()
+    engine_class = ENGINES.get(algorithm)
+    if engine_class is None:
+        logger.warning(f"Unknown RATE_LIMIT_ALGORITHM '{algorithm}', using gcra")
+        engine_class = GCRARateLimiter
+    engine = engine_class()
+
+    lease_fraction = float(os.getenv("RATE_LIMIT_LEASE_FRACTION", 0))
+    if lease_fraction > 0:
+        lease_ttl = float(os.getenv("RATE_LIMIT_LEASE_TTL", 1))
+        return LeasedRateLimiter(engine, lease_fraction, lease_ttl)
+
+    return engine
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from asyncwhois.errors import NotFoundError
+from loguru import logger
+
+from app.services.metrics import WHOIS_IN_FLIGHT, WHOIS_QUERY_DURATION, observe
+from app.services.timing import phase
+from app.services.whois_throttle import WhoisRefused, WhoisThrottle
+
+
+# IANA bootstrap registry mapping TLDs to RDAP servers (RFC 9224)
+IANA_BOOTSTRAP_URL = "https://data.iana.org/rdap/dns.json"
+
+
+def _parse_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def _vcard(entity: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten the jCard of an entity into {property: value}"""
+    fields: Dict[str, Any] = {}
+    vcard = entity.get("vcardArray")
+    if not isinstance(vcard, list) or len(vcard) < 2:
+        return fields
+    for prop in vcard[1]:
+        if len(prop) < 4 or prop[0] in fields:
+            continue
+        value = prop[3]
+        if prop[0] == "adr" and isinstance(value, list):
+            value = ", ".join(str(part) for part in value if part)
+        fields[prop[0]] = value
+    return fields
+
+
+def parse_rdap_domain(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Map an RDAP domain object (RFC 9083) to the keys asyncwhois uses for
+    port 43 WHOIS, so both backends produce the same parsed data
+    """
+    events = {event.get("eventAction"): event.get("eventDate") for event in data.get("events", [])}
+    parsed: Dict[str, Any] = {
+        "domain_name": (data.get("ldhName") or "").lower() or None,
+        "created": _parse_date(events.get("registration")),
+        "updated": _parse_date(events.get("last changed")),
+        "expires": _parse_date(events.get("expiration")),
+        "status": data.get("status", []),
+        "name_servers": [ns["ldhName"].lower() for ns in data.get("nameservers", []) if ns.get("ldhName")],
+        "dnssec": None,
+    }
+
+    secure_dns = data.get("secureDNS")
+    if isinstance(secure_dns, dict) and "delegationSigned" in secure_dns:
+        parsed["dnssec"] = "signed" if secure_dns["delegationSigned"] else "unsigned"
+
+    for entity in data.get("entities", []):
+        roles = entity.get("roles", [])
+        vcard = _vcard(entity)
+        if "registrar" in roles:
+            parsed["registrar"] = vcard.get("fn")
+            for public_id in entity.get("publicIds", []):
+                if public_id.get("type") == "IANA Registrar ID":
+                    parsed["registrar_iana_id"] = public_id.get("identifier")
+            for sub_entity in entity.get("entities", []):
+                if "abuse" in sub_entity.get("roles", []):
+                    abuse = _vcard(sub_entity)
+                    parsed["registrar_abuse_email"] = abuse.get("email")
+                    parsed["registrar_abuse_phone"] = abuse.get("tel")
+        for role in ("registrant", "administrative", "technical", "billing"):
+            if role in roles:
+                prefix = {"administrative": "admin", "technical": "tech"}.get(role, role)
+                parsed[f"{prefix}_name"] = vcard.get("fn")
+                parsed[f"{prefix}_organization"] = vcard.get("org")
+                parsed[f"{prefix}_address"] = vcard.get("adr")
+                parsed[f"{prefix}_email"] = vcard.get("email")
+                parsed[f"{prefix}_phone"] = vcard.get("tel")
+
+    return parsed
+
+
+class RDAPClient:
+    """
+    Domain lookups over RDAP with pooled, kept-alive HTTP connections
+
+    TLDs are mapped to RDAP servers with the IANA bootstrap registry, which
+    is cached in RDAP_BOOTSTRAP_FILE and refreshed after RDAP_BOOTSTRAP_TTL.
+    Queries share the per-server throttles of port 43 WHOIS.
+    """
+
+    def __init__(self, throttle: WhoisThrottle, client: Optional[httpx.AsyncClient] = None):
+        self.throttle = throttle
+        self.bootstrap_url = os.getenv("RDAP_BOOTSTRAP_URL", IANA_BOOTSTRAP_URL)
+        self.bootstrap_file = os.getenv("RDAP_BOOTSTRAP_FILE", "data/rdap_bootstrap.json")
+        self.bootstrap_ttl = float(os.getenv("RDAP_BOOTSTRAP_TTL", 86400))
+        self.timeout = float(os.getenv("RDAP_TIMEOUT", 10))
+        self._client = client or httpx.AsyncClient(
+            http2=True,
+            follow_redirects=True,
+            limits=httpx.Limits(max_keepalive_connections=int(os.getenv("RDAP_MAX_CONNECTIONS", 20))),
+            headers={"accept": "application/rdap+json, application/json"},
+        )
+        self._servers: Dict[str, str] = {}
+        self._loaded_at = 0.0
+        self._load_lock = asyncio.Lock()
+
+        self.queries = 0
+        self.bootstrap_loads = 0
+
+    async def server_for(self, tld: str) -> Optional[str]:
+        """Base URL of the RDAP server for a TLD, or None if it has none"""
+        if time.time() - self._loaded_at > self.bootstrap_ttl:
+            async with self._load_lock:
+                if time.time() - self._loaded_at > self.bootstrap_ttl:
+                    await self._load_bootstrap()
+        return self._servers.get(tld.lower())
+
+    async def _load_bootstrap(self) -> None:
+        """Load the bootstrap registry from the local copy or from IANA when it is stale"""
+        data = None
+        stale = None
+        if self.bootstrap_file:
+            try:
+                data = await asyncio.to_thread(self._read_file)
+                if time.time() - os.path.getmtime(self.bootstrap_file) > self.bootstrap_ttl:
+                    stale, data = data, None
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Ignoring RDAP bootstrap file {self.bootstrap_file}: {e}")
+
+        # Retry a failed fetch after a minute, not a whole TTL
+        loaded_at = time.time()
+        if data is None:
+            try:
+                response = await self._client.get(self.bootstrap_url, timeout=self.timeout)
+                response.raise_for_status()
+                data = response.json()
+                if self.bootstrap_file:
+                    await asyncio.to_thread(self._write_file, response.content)
+            except Exception as e:
+                logger.error(f"Failed to fetch RDAP bootstrap registry: {e}")
+                data = stale
+                loaded_at = time.time() - self.bootstrap_ttl + 60
+
+        if data is None:
+            # Port 43 is used meanwhile
+            self._loaded_at = loaded_at
+            return
+
+        servers = {}
+        for tlds, urls in data.get("services", []):
+            # Prefer https, as the registry recommends
+            urls = sorted(urls, key=lambda url: not url.startswith("https://"))
+            for tld in tlds:
+                servers[tld.lower()] = urls[0].rstrip("/") + "/"
+        self._servers = servers
+        self._loaded_at = loaded_at
+        self.bootstrap_loads += 1
+
+    def _read_file(self) -> Dict[str, Any]:
+        with open(self.bootstrap_file) as f:
+            return json.load(f)
+
+    def _write_file(self, content: bytes) -> None:
+        directory = os.path.dirname(self.bootstrap_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.bootstrap_file}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, self.bootstrap_file)
+
+    async def lookup(self, domain: str, base_url: str) -> Tuple[str, Dict[str, Any]]:
+        """Query the RDAP server for a domain, returning the JSON text and parsed data"""
+        throttle = self.throttle.server(httpx.URL(base_url).host)
+        async with throttle.slot():
+            self.queries += 1
+            with phase("rdap"), observe(WHOIS_QUERY_DURATION, WHOIS_IN_FLIGHT, throttle.server, "rdap") as observation:
+                try:
+                    response = await self._client.get(f"{base_url}domain/{domain}", timeout=self.timeout)
+                except httpx.TransportError:
+                    throttle.record_refusal()
+                    raise
+
+                if response.status_code == 404:
+                    observation.outcome = "not_found"
+                    throttle.record_success()
+                    raise NotFoundError("Domain not found!")
+                if response.status_code in (403, 429) or response.status_code >= 500:
+                    observation.outcome = "refused"
+                    throttle.record_refusal()
+                    raise WhoisRefused(f"RDAP server {throttle.server} returned HTTP {response.status_code}, try again later")
+                response.raise_for_status()
+                throttle.record_success()
+
+        return response.text, parse_rdap_domain(response.json())
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tlds": len(self._servers),
+            "queries": self.queries,
+            "bootstrap_loads": self.bootstrap_loads,
+        }
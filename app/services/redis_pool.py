@@ -0,0 +1,79 @@
+import os
+from typing import Any, Dict, List, Optional
+
+import redis.asyncio as redis
+from loguru import logger
+from redis.asyncio.client import Pipeline
+
+from app.services.metrics import REDIS_COMMAND_DURATION, observe
+
+
+# Shared clients for the worker, each backed by its own connection pool.
+# Text clients decode responses to str, binary clients return raw bytes.
+_redis_clients: Dict[bool, redis.Redis] = {}
+
+
+class InstrumentedPipeline(Pipeline):
+    """Pipeline recording the round trip time of every execution"""
+
+    async def execute(self, raise_on_error: bool = True) -> List[Any]:
+        with observe(REDIS_COMMAND_DURATION, None, "MULTI" if self.is_transaction else "PIPELINE"):
+            return await super().execute(raise_on_error)
+
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client recording the round trip time of every command"""
+
+    async def execute_command(self, *args: Any, **options: Any) -> Any:
+        with observe(REDIS_COMMAND_DURATION, None, str(args[0]).upper()):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def _create_client(binary: bool = False) -> redis.Redis:
+    """Create a Redis client with a connection pool configured from the environment"""
+    redis_host = os.getenv("REDIS_HOST", "localhost")
+    redis_port = int(os.getenv("REDIS_PORT", 6379))
+    max_connections = int(os.getenv("REDIS_MAX_CONNECTIONS", 100))
+    socket_timeout = float(os.getenv("REDIS_SOCKET_TIMEOUT", 5))
+    connect_timeout = float(os.getenv("REDIS_CONNECT_TIMEOUT", 5))
+    # How long to wait for a free connection when the pool is exhausted
+    pool_timeout = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+
+    pool = redis.BlockingConnectionPool(
+        host=redis_host,
+        port=redis_port,
+        max_connections=max_connections,
+        timeout=pool_timeout,
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=connect_timeout,
+        decode_responses=not binary,
+    )
+    return InstrumentedRedis(connection_pool=pool)
+
+
+def get_redis(binary: bool = False) -> redis.Redis:
+    """Return the shared Redis client, creating it on first use"""
+    client = _redis_clients.get(binary)
+    if client is None:
+        client = _redis_clients[binary] = _create_client(binary)
+    return client
+
+
+async def init_redis() -> redis.Redis:
+    """Create the shared Redis client and check the connection"""
+    client = get_redis()
+    try:
+        await client.ping()
+    except redis.RedisError as e:
+        logger.error(f"Redis is not reachable: {e}")
+    return client
+
+
+async def close_redis() -> None:
+    """Close the shared Redis clients and their connection pools"""
+    for client in list(_redis_clients.values()):
+        await client.aclose()
+    _redis_clients.clear()
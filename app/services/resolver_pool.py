@@ -0,0 +1,199 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.resolver
+
+from app.services.hedging import HedgePolicy
+from app.services.metrics import DNS_UPSTREAM_DURATION, DNS_UPSTREAM_IN_FLIGHT, observe
+from app.services.upstreams import FAILURE_RCODES, Upstream, UpstreamManager
+
+
+@dataclass(frozen=True)
+class ResolverProfile:
+    """Options that select a preconfigured resolver"""
+    dnssec: bool = False
+    timeout: float = 5.0
+    edns_payload: int = 1232
+    # Upstream names to use, None for every configured upstream
+    nameservers: Optional[Tuple[str, ...]] = None
+
+
+class UpstreamResolver:
+    """
+    Stub resolver bound to one profile
+
+    Queries go to the upstreams chosen by the UpstreamManager, best first,
+    and every attempt feeds its health statistics. The profile is fixed at
+    construction, so resolvers can be shared freely between requests.
+    """
+
+    def __init__(self, profile: ResolverProfile, upstreams: UpstreamManager, hedging: HedgePolicy):
+        self.profile = profile
+        self.upstreams = upstreams
+        self.hedging = hedging
+
+    def make_query(self, qname: dns.name.Name, rdtype: int) -> dns.message.Message:
+        """Build a query message with this profile's options"""
+        profile = self.profile
+        request = dns.message.make_query(
+            qname,
+            rdtype,
+            use_edns=0,
+            payload=profile.edns_payload,
+            want_dnssec=profile.dnssec,
+        )
+        if profile.dnssec:
+            # Ask for the upstream's validation result
+            request.flags |= dns.flags.AD
+        return request
+
+    async def resolve(self, qname: dns.name.Name, rdtype: int) -> dns.message.Message:
+        """
+        Resolve a query, returning the first usable upstream response
+
+        Upstreams are tried one after another. With hedging enabled, a query
+        the first upstream has not answered within the hedge delay is also
+        sent to the next upstream; the first usable answer wins and the
+        other query is cancelled.
+
+        NXDOMAIN and empty answers are returned as responses. Raises
+        LifetimeTimeout when the profile timeout runs out and NoNameservers
+        when every upstream tried failed.
+        """
+        request = self.make_query(qname, rdtype)
+        deadline = time.monotonic() + self.profile.timeout
+        candidates = self.upstreams.select(self.profile.nameservers)
+        errors: List[tuple] = []
+        # In-flight attempts, mapped to whether they are hedges
+        pending: Dict[asyncio.Task, bool] = {}
+        hedge_delay = self.hedging.delay()
+        self.hedging.start_query()
+        
+        def launch(hedge: bool = False) -> None:
+            remaining = deadline - time.monotonic()
+            if not candidates or remaining <= 0:
+                return
+            upstream = candidates.pop(0)
+            timeout = min(remaining, self.upstreams.attempt_timeout)
+            pending[asyncio.create_task(self._attempt(upstream, request, timeout, errors))] = hedge
+        
+        launch()
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                
+                wait = remaining if hedge_delay is None else min(remaining, hedge_delay)
+                done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                
+                if not done:
+                    # The first upstream is slow: hedge once, within budget
+                    if hedge_delay is not None and candidates and self.hedging.try_hedge():
+                        launch(hedge=True)
+                    hedge_delay = None
+                    continue
+                
+                for task in done:
+                    hedge = pending.pop(task)
+                    response = task.result()
+                    if response is not None:
+                        if hedge:
+                            self.hedging.won += 1
+                        return response
+                
+                # Every attempt so far failed, fail over to the next upstream
+                if not pending:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        if time.monotonic() >= deadline:
+            raise dns.resolver.LifetimeTimeout(timeout=self.profile.timeout, errors=errors)
+        raise dns.resolver.NoNameservers(request=request, errors=errors)
+    
+    async def _attempt(
+        self,
+        upstream: Upstream,
+        request: dns.message.Message,
+        timeout: float,
+        errors: List[tuple]
+    ) -> Optional[dns.message.Message]:
+        """Query one upstream and record the outcome, returning None on failure"""
+        start = time.monotonic()
+        with observe(DNS_UPSTREAM_DURATION, DNS_UPSTREAM_IN_FLIGHT, upstream.name) as observation:
+            try:
+                response = await upstream.query(request, timeout)
+            except dns.exception.Timeout as e:
+                observation.outcome = "timeout"
+                upstream.record_failure(timeout=True)
+                errors.append((upstream.name, upstream.transport.protocol != "udp", upstream.transport.port, e, None))
+                return None
+            except Exception as e:
+                observation.outcome = "error"
+                upstream.record_failure()
+                errors.append((upstream.name, upstream.transport.protocol != "udp", upstream.transport.port, e, None))
+                return None
+            
+            if response.rcode() in FAILURE_RCODES:
+                observation.outcome = dns.rcode.to_text(response.rcode()).lower()
+                upstream.record_failure()
+                errors.append((upstream.name, upstream.transport.protocol != "udp", upstream.transport.port, None, response))
+                return None
+        
+        rtt = time.monotonic() - start
+        upstream.record_success(rtt)
+        self.hedging.observe(rtt)
+        return response
+
+
+class ResolverPool:
+    """
+    Preconfigured resolvers keyed by profile
+
+    Each resolver is configured once when its profile is first used and is
+    never modified afterwards, so concurrent requests with different options
+    never see each other's settings.
+    """
+
+    def __init__(self, upstreams: Optional[UpstreamManager] = None):
+        self.upstreams = upstreams or UpstreamManager()
+        # Shared by every profile so the hedge budget covers all queries
+        self.hedging = HedgePolicy()
+        self.default_profile = ResolverProfile(
+            timeout=float(os.getenv("DNS_TIMEOUT", 5)),
+            edns_payload=int(os.getenv("DNS_EDNS_PAYLOAD", 1232)),
+        )
+        self._resolvers: Dict[ResolverProfile, UpstreamResolver] = {}
+
+    def profile(
+        self,
+        dnssec: bool = False,
+        timeout: Optional[float] = None,
+        edns_payload: Optional[int] = None,
+        nameservers: Optional[Tuple[str, ...]] = None
+    ) -> ResolverProfile:
+        """Build a profile, taking unset options from the default profile"""
+        default = self.default_profile
+        return ResolverProfile(
+            dnssec=dnssec,
+            timeout=default.timeout if timeout is None else timeout,
+            edns_payload=default.edns_payload if edns_payload is None else edns_payload,
+            nameservers=default.nameservers if nameservers is None else tuple(nameservers),
+        )
+
+    def get(self, profile: ResolverProfile) -> UpstreamResolver:
+        """Return the resolver for a profile, creating it on first use"""
+        resolver = self._resolvers.get(profile)
+        if resolver is None:
+            resolver = self._resolvers[profile] = UpstreamResolver(profile, self.upstreams, self.hedging)
+        return resolver
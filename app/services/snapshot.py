@@ -0,0 +1,149 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+import msgpack
+from loguru import logger
+
+from app.services.redis_pool import get_redis
+
+
+# Bumped when the snapshot layout changes, older snapshots are ignored
+SNAPSHOT_VERSION = 1
+
+# Redis key holding the snapshot when CACHE_SNAPSHOT is "redis"
+SNAPSHOT_REDIS_KEY = "snapshot:caches"
+
+
+class CacheSnapshot:
+    """
+    Saves in-process caches so restarted workers start warm
+
+    Every source is an object with `snapshot()` returning msgpack-friendly
+    data and `restore(data)` loading it back and returning how many items
+    it restored. CACHE_SNAPSHOT selects where snapshots go: "redis" for a
+    shared Redis key, or a file path. Snapshots are taken on a timer and on
+    shutdown; every worker restores the latest one on startup. Cached
+    entries carry absolute expiry times, so anything that expired while the
+    workers were down is dropped on restore.
+    """
+
+    def __init__(self, sources: Dict[str, Any]):
+        self.sources = sources
+        self.target = os.getenv("CACHE_SNAPSHOT", "")
+        self.interval = float(os.getenv("CACHE_SNAPSHOT_INTERVAL", 300))
+        self._task: Optional[asyncio.Task] = None
+
+        self.saved = 0
+        self.restored = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.target)
+
+    async def save(self) -> None:
+        """Snapshot every source"""
+        if not self.enabled:
+            return
+
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "created_at": time.time(),
+            "sources": {name: source.snapshot() for name, source in self.sources.items()},
+        }
+        try:
+            # Packing and writing happen off the event loop, the data is a copy
+            data = await asyncio.to_thread(msgpack.packb, snapshot, use_bin_type=True)
+            if self.target == "redis":
+                await get_redis(binary=True).set(SNAPSHOT_REDIS_KEY, data)
+            else:
+                await asyncio.to_thread(self._write_file, data)
+            self.saved += 1
+            logger.info(f"Saved cache snapshot ({len(data)} bytes)")
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Failed to save cache snapshot: {e}")
+
+    def _write_file(self, data: bytes) -> None:
+        # Write then rename, so a reader never sees a partial snapshot
+        tmp_path = f"{self.target}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.target)
+
+    def _read_file(self) -> Optional[bytes]:
+        try:
+            with open(self.target, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    async def restore(self) -> Dict[str, int]:
+        """Load the latest snapshot into every source, returns the items restored per source"""
+        if not self.enabled:
+            return {}
+
+        try:
+            if self.target == "redis":
+                data = await get_redis(binary=True).get(SNAPSHOT_REDIS_KEY)
+            else:
+                data = await asyncio.to_thread(self._read_file)
+            if data is None:
+                return {}
+            snapshot = await asyncio.to_thread(msgpack.unpackb, data, raw=False)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Failed to load cache snapshot: {e}")
+            return {}
+
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring cache snapshot with version {snapshot.get('version')}")
+            return {}
+
+        counts = {}
+        for name, source in self.sources.items():
+            section = snapshot["sources"].get(name)
+            if section is None:
+                continue
+            try:
+                counts[name] = source.restore(section)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Failed to restore {name} cache snapshot: {e}")
+
+        self.restored += sum(counts.values())
+        age = time.time() - snapshot.get("created_at", 0)
+        logger.info(f"Restored cache snapshot taken {age:.0f}s ago: {counts}")
+        return counts
+
+    async def start(self) -> None:
+        """Start taking snapshots in the background"""
+        if self.enabled and self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Stop the timer and take a final snapshot"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.save()
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.save()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return snapshot counters"""
+        return {
+            "enabled": self.enabled,
+            "saved": self.saved,
+            "restored": self.restored,
+            "errors": self.errors,
+        }
@@ -0,0 +1,110 @@
+import heapq
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from itertools import count
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class RequestTiming:
+    """
+    Time spent in each phase of a request
+
+    Phases that run several times, or concurrently as in a batch, add up,
+    so their total can exceed the duration of the request.
+    """
+    __slots__ = ("start", "phases")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # Phase name -> [seconds, calls]
+        self.phases: Dict[str, List[Any]] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        phase = self.phases.get(name)
+        if phase is None:
+            self.phases[name] = [seconds, 1]
+        else:
+            phase[0] += seconds
+            phase[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {name: {"ms": round(seconds * 1000, 3), "calls": calls} for name, (seconds, calls) in self.phases.items()}
+
+    def server_timing(self, total: float) -> str:
+        """Server-Timing header value, durations in milliseconds"""
+        metrics = []
+        for name, (seconds, calls) in self.phases.items():
+            metric = f"{name};dur={seconds * 1000:.3f}"
+            if calls > 1:
+                metric += f';desc="{calls} calls"'
+            metrics.append(metric)
+        metrics.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(metrics)
+
+
+# Timing of the request being served, None outside requests.
+# Tasks started by a request inherit it.
+current_timing: ContextVar[Optional[RequestTiming]] = ContextVar("current_timing", default=None)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Add the time spent in the block to a phase of the current request"""
+    timing = current_timing.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - start)
+
+
+class SlowRequestLog:
+    """
+    The slowest requests served by this worker, with their phase timings
+
+    Keeps the SLOW_REQUESTS_KEEP slowest requests in a min-heap, so a request
+    faster than all of them is discarded with one comparison.
+    """
+
+    def __init__(self, size: Optional[int] = None):
+        self.size = size if size is not None else int(os.getenv("SLOW_REQUESTS_KEEP", 20))
+        self._heap: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._counter = count()
+
+    def record(self, seconds: float, request: Dict[str, Any], timing: RequestTiming) -> None:
+        if self.size <= 0:
+            return
+        if len(self._heap) >= self.size and seconds <= self._heap[0][0]:
+            return
+
+        entry = {
+            **request,
+            "ms": round(seconds * 1000, 3),
+            "at": datetime.now(timezone.utc).isoformat(),
+            "phases": timing.to_dict(),
+        }
+        item = (seconds, next(self._counter), entry)
+        if len(self._heap) >= self.size:
+            heapq.heapreplace(self._heap, item)
+        else:
+            heapq.heappush(self._heap, item)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Recorded requests, slowest first"""
+        return [entry for _, _, entry in sorted(self._heap, reverse=True)]
+
+    def clear(self) -> None:
+        self._heap.clear()
+
+
+# Slowest requests of this worker
+slow_requests = SlowRequestLog()
@@ -0,0 +1,294 @@
+import asyncio
+import os
+import random
+import ssl
+import struct
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+import dns.asyncquery
+import dns.exception
+import dns.flags
+import dns.message
+import dns.query
+import httpx
+
+
+class Transport(ABC):
+    """Sends DNS query messages to one upstream and returns the responses"""
+
+    protocol = ""
+
+    def __init__(self, address: str, port: int):
+        self.address = address
+        self.port = port
+
+    @property
+    def name(self) -> str:
+        host = f"[{self.address}]" if ":" in self.address else self.address
+        return f"{host}:{self.port}"
+
+    @abstractmethod
+    async def query(self, request: dns.message.Message, timeout: float) -> dns.message.Message:
+        """Send a query and return the response, raising dns.exception.Timeout after timeout seconds"""
+
+    async def close(self) -> None:
+        pass
+
+
+class _StreamConnection:
+    """
+    One persistent TCP or TLS connection carrying pipelined queries (RFC 7766)
+
+    Queries are written as soon as they arrive and responses are matched to
+    them by message ID, so they may complete in any order. Query IDs are
+    rewritten to be unique on the connection and restored in the responses.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._waiters: Dict[int, asyncio.Future] = {}
+        self._write_lock = asyncio.Lock()
+        self._read_task = asyncio.create_task(self._read_loop())
+        self.closed = False
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._waiters)
+
+    async def query(self, request: dns.message.Message, timeout: float) -> dns.message.Message:
+        if self.closed:
+            raise ConnectionError("Connection closed")
+
+        query_id = random.randint(0, 0xFFFF)
+        while query_id in self._waiters:
+            query_id = random.randint(0, 0xFFFF)
+
+        wire = struct.pack("!H", query_id) + request.to_wire()[2:]
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[query_id] = future
+        try:
+            async with self._write_lock:
+                self._writer.write(struct.pack("!H", len(wire)) + wire)
+                await self._writer.drain()
+            try:
+                data = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                raise dns.exception.Timeout(timeout=timeout)
+        finally:
+            self._waiters.pop(query_id, None)
+
+        response = dns.message.from_wire(struct.pack("!H", request.id) + data[2:])
+        if not request.is_response(response):
+            raise dns.query.BadResponse
+        return response
+
+    async def _read_loop(self) -> None:
+        error: Exception = ConnectionError("Connection closed by upstream")
+        try:
+            while True:
+                header = await self._reader.readexactly(2)
+                (length,) = struct.unpack("!H", header)
+                data = await self._reader.readexactly(length)
+                if length < 2:
+                    continue
+                (query_id,) = struct.unpack("!H", data[:2])
+                future = self._waiters.get(query_id)
+                if future is not None and not future.done():
+                    future.set_result(data)
+        except asyncio.IncompleteReadError:
+            pass
+        except asyncio.CancelledError:
+            error = ConnectionError("Connection closed")
+        except Exception as e:
+            error = e
+        finally:
+            self.closed = True
+            for future in self._waiters.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._writer.close()
+
+    async def close(self) -> None:
+        self.closed = True
+        self._read_task.cancel()
+        try:
+            await self._read_task
+        except asyncio.CancelledError:
+            pass
+
+
+class StreamTransport(Transport):
+    """
+    DNS over TCP, or over TLS (DoT, RFC 7858) when given an SSL context
+
+    Keeps a small pool of persistent connections and spreads queries over
+    them, reconnecting when the upstream closes one.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        port: int,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        server_hostname: Optional[str] = None,
+        pool_size: Optional[int] = None
+    ):
+        super().__init__(address, port)
+        self.protocol = "tls" if ssl_context is not None else "tcp"
+        self.ssl_context = ssl_context
+        self.server_hostname = server_hostname
+        self.pool_size = pool_size or int(os.getenv("DNS_STREAM_POOL_SIZE", 2))
+        self._connections: List[_StreamConnection] = []
+        self._connect_lock = asyncio.Lock()
+
+        self.connects = 0
+
+    async def _connection(self, timeout: float) -> _StreamConnection:
+        self._connections = [c for c in self._connections if not c.closed]
+        idle = [c for c in self._connections if c.in_flight == 0]
+        if idle or len(self._connections) >= self.pool_size:
+            return min(self._connections, key=lambda c: c.in_flight)
+
+        async with self._connect_lock:
+            self._connections = [c for c in self._connections if not c.closed]
+            if len(self._connections) >= self.pool_size:
+                return min(self._connections, key=lambda c: c.in_flight)
+
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(
+                        self.address,
+                        self.port,
+                        ssl=self.ssl_context,
+                        server_hostname=self.server_hostname if self.ssl_context else None,
+                    ),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                raise dns.exception.Timeout(timeout=timeout)
+
+            connection = _StreamConnection(reader, writer)
+            self._connections.append(connection)
+            self.connects += 1
+            return connection
+
+    async def query(self, request: dns.message.Message, timeout: float) -> dns.message.Message:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        connection = await self._connection(timeout)
+        return await connection.query(request, max(0.0, deadline - loop.time()))
+
+    async def close(self) -> None:
+        for connection in self._connections:
+            await connection.close()
+        self._connections = []
+
+
+class UDPTransport(Transport):
+    """Plain DNS over UDP, retrying truncated answers over pooled TCP connections"""
+
+    protocol = "udp"
+
+    def __init__(self, address: str, port: int = 53):
+        super().__init__(address, port)
+        self.tcp = StreamTransport(address, port)
+
+    async def query(self, request: dns.message.Message, timeout: float) -> dns.message.Message:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        response = await dns.asyncquery.udp(request, self.address, timeout=timeout, port=self.port, ignore_unexpected=True)
+        if response.flags & dns.flags.TC:
+            response = await self.tcp.query(request, max(0.0, deadline - loop.time()))
+        return response
+
+    async def close(self) -> None:
+        await self.tcp.close()
+
+
+class HTTPSTransport(Transport):
+    """
+    DNS over HTTPS (DoH, RFC 8484)
+
+    Uses one pooled HTTP/2 client per upstream, so concurrent queries are
+    multiplexed over a single kept-alive connection.
+    """
+
+    protocol = "https"
+
+    def __init__(self, url: str, client: Optional[httpx.AsyncClient] = None):
+        parsed = httpx.URL(url)
+        super().__init__(parsed.host, parsed.port or 443)
+        self.url = url
+        self._client = client or httpx.AsyncClient(
+            http2=True,
+            verify=tls_context(),
+            limits=httpx.Limits(max_connections=int(os.getenv("DNS_STREAM_POOL_SIZE", 2))),
+        )
+
+    @property
+    def name(self) -> str:
+        return self.url
+
+    async def query(self, request: dns.message.Message, timeout: float) -> dns.message.Message:
+        # RFC 8484 recommends ID 0 so answers are cache friendly
+        wire = b"\x00\x00" + request.to_wire()[2:]
+        try:
+            reply = await self._client.post(
+                self.url,
+                content=wire,
+                headers={"content-type": "application/dns-message", "accept": "application/dns-message"},
+                timeout=timeout,
+            )
+        except httpx.TimeoutException:
+            raise dns.exception.Timeout(timeout=timeout)
+
+        if reply.status_code != 200:
+            raise ConnectionError(f"DoH upstream returned HTTP {reply.status_code}")
+
+        response = dns.message.from_wire(struct.pack("!H", request.id) + reply.content[2:])
+        if not request.is_response(response):
+            raise dns.query.BadResponse
+        return response
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def tls_context() -> ssl.SSLContext:
+    """TLS context for encrypted upstreams, trusting DNS_TLS_CA_FILE if set"""
+    context = ssl.create_default_context(cafile=os.getenv("DNS_TLS_CA_FILE") or None)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    return context
+
+
+def _split_host_port(spec: str, default_port: int):
+    if spec.startswith("["):
+        address, _, port = spec[1:].partition("]")
+        return address, int(port.lstrip(":") or default_port)
+    if spec.count(":") == 1:
+        address, port = spec.split(":")
+        return address, int(port)
+    return spec, default_port
+
+
+def create_transport(spec: str) -> Transport:
+    """
+    Create the transport for an upstream spec:
+
+    - "address", "address:port" or "[ipv6]:port": UDP with TCP fallback
+    - "tls://address[:port][#server_name]": DNS over TLS (port 853)
+    - "https://host/path": DNS over HTTPS
+    """
+    spec = spec.strip()
+    if spec.startswith("https://"):
+        return HTTPSTransport(spec)
+
+    if spec.startswith("tls://"):
+        host, _, server_name = spec[len("tls://"):].partition("#")
+        address, port = _split_host_port(host, 853)
+        return StreamTransport(address, port, ssl_context=tls_context(), server_hostname=server_name or address)
+
+    address, port = _split_host_port(spec, 53)
+    return UDPTransport(address, port)
@@ -0,0 +1,234 @@
+import asyncio
+import os
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import dns.exception
+import dns.message
+import dns.rcode
+import dns.rdatatype
+from loguru import logger
+
+from app.services.transports import Transport, create_transport
+
+
+# Upstream nameservers used when neither DNS_UPSTREAMS_FILE nor DNS_NAMESERVERS is set
+DEFAULT_NAMESERVERS = ('8.8.8.8', '8.8.4.4', '1.1.1.1', '1.0.0.1')
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+
+# Response codes that mean the upstream could not answer, as opposed to an
+# authoritative answer such as NXDOMAIN
+FAILURE_RCODES = frozenset((dns.rcode.SERVFAIL, dns.rcode.REFUSED, dns.rcode.NOTIMP, dns.rcode.FORMERR))
+
+
+class Upstream:
+    """
+    An upstream nameserver with its health statistics
+
+    Round trip time and failure rate are exponentially weighted moving
+    averages. After `failure_threshold` consecutive failures the circuit
+    opens and the upstream gets no traffic until a probe succeeds.
+    """
+
+    def __init__(self, transport: Transport, alpha: float = 0.2, failure_threshold: int = 5):
+        self.transport = transport
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+
+        # Optimistic start so new upstreams get tried
+        self.ewma_rtt = 0.05
+        self.failure_rate = 0.0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at: Optional[float] = None
+
+        self.queries = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.trips = 0
+
+    @property
+    def name(self) -> str:
+        return self.transport.name
+
+    @property
+    def healthy(self) -> bool:
+        return self.state == CLOSED
+
+    def score(self) -> float:
+        """Lower is better: RTT inflated by the recent failure rate"""
+        return self.ewma_rtt * (1 + 4 * self.failure_rate)
+
+    def record_success(self, rtt: float) -> None:
+        self.queries += 1
+        self.ewma_rtt += self.alpha * (rtt - self.ewma_rtt)
+        self.failure_rate -= self.alpha * self.failure_rate
+        self.consecutive_failures = 0
+        if self.state == OPEN:
+            logger.info(f"Upstream {self.name} recovered")
+            self.state = CLOSED
+            self.opened_at = None
+
+    def record_failure(self, timeout: bool = False) -> None:
+        self.queries += 1
+        self.errors += 1
+        if timeout:
+            self.timeouts += 1
+        self.failure_rate += self.alpha * (1 - self.failure_rate)
+        self.consecutive_failures += 1
+        if self.state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+            logger.warning(f"Upstream {self.name} failed {self.consecutive_failures} times in a row, opening circuit")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.trips += 1
+
+    async def query(self, request: dns.message.Message, timeout: float) -> dns.message.Message:
+        """Send a query through this upstream's transport"""
+        return await self.transport.query(request, timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "protocol": self.transport.protocol,
+            "state": self.state,
+            "ewma_rtt_ms": round(self.ewma_rtt * 1000, 2),
+            "failure_rate": round(self.failure_rate, 4),
+            "consecutive_failures": self.consecutive_failures,
+            "queries": self.queries,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "trips": self.trips,
+        }
+
+
+class UpstreamManager:
+    """
+    Tracks the health of every upstream nameserver and orders them for queries
+
+    Upstreams come from DNS_UPSTREAMS_FILE (one nameserver per line, `#` at the
+    start of a line or after whitespace starts a comment, so the
+    `tls://address#server_name` form keeps its server name) or DNS_NAMESERVERS (comma-separated), in any form accepted by
+    create_transport: plain UDP, DNS over TLS or DNS over HTTPS. Healthy
+    upstreams are tried fastest first; upstreams with an open circuit are only
+    used when no healthy one is left. A background task probes every upstream so RTTs stay
+    current and open circuits close again once the upstream answers.
+    """
+
+    def __init__(self, nameservers: Optional[Iterable[str]] = None):
+        alpha = float(os.getenv("DNS_UPSTREAM_EWMA_ALPHA", 0.2))
+        failure_threshold = int(os.getenv("DNS_UPSTREAM_FAILURE_THRESHOLD", 5))
+        # Upstreams tried per query before giving up
+        self.max_attempts = int(os.getenv("DNS_UPSTREAM_MAX_ATTEMPTS", 3))
+        # Timeout for a single upstream attempt
+        self.attempt_timeout = float(os.getenv("DNS_UPSTREAM_ATTEMPT_TIMEOUT", 1.0))
+        self.probe_interval = float(os.getenv("DNS_UPSTREAM_PROBE_INTERVAL", 5))
+        self.probe_name = os.getenv("DNS_UPSTREAM_PROBE_NAME", ".")
+
+        specs = list(nameservers) if nameservers is not None else self._configured_nameservers()
+        self.upstreams: List[Upstream] = []
+        for spec in specs:
+            self.upstreams.append(Upstream(create_transport(spec), alpha, failure_threshold))
+
+        self._probe_task: Optional[asyncio.Task] = None
+
+    def _configured_nameservers(self) -> List[str]:
+        path = os.getenv("DNS_UPSTREAMS_FILE")
+        if path:
+            with open(path) as f:
+                specs = [
+                    re.split(r"\s+#", line, 1)[0].strip()
+                    for line in f
+                    if not line.lstrip().startswith("#")
+                ]
+            specs = [spec for spec in specs if spec]
+            if specs:
+                return specs
+            logger.warning(f"No nameservers in {path}, using defaults")
+
+        nameservers = os.getenv("DNS_NAMESERVERS")
+        if nameservers:
+            return [ns.strip() for ns in nameservers.split(",") if ns.strip()]
+        return list(DEFAULT_NAMESERVERS)
+
+    @property
+    def addresses(self) -> Tuple[str, ...]:
+        return tuple(upstream.name for upstream in self.upstreams)
+
+    def select(self, names: Optional[Tuple[str, ...]] = None) -> List[Upstream]:
+        """
+        Upstreams to try for a query, best first
+
+        names restricts the choice to a subset of upstreams (by name as in
+        `addresses`). Falls back to open circuits, longest open first, when
+        no healthy upstream is available.
+        """
+        candidates = self.upstreams if names is None else [u for u in self.upstreams if u.name in names]
+        healthy = sorted((u for u in candidates if u.healthy), key=Upstream.score)
+        if healthy:
+            return healthy[:self.max_attempts]
+        return sorted(candidates, key=lambda u: u.opened_at or 0)[:self.max_attempts]
+
+    async def start(self) -> None:
+        """Start probing upstreams in the background"""
+        if self._probe_task is None and self.probe_interval > 0:
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self) -> None:
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+        for upstream in self.upstreams:
+            await upstream.transport.close()
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            await self.probe_all()
+
+    async def probe(self, upstream: Upstream) -> bool:
+        """Send a probe query to an upstream and record the outcome"""
+        request = dns.message.make_query(self.probe_name, dns.rdatatype.NS)
+        start = time.monotonic()
+        try:
+            response = await upstream.query(request, self.attempt_timeout)
+        except dns.exception.Timeout:
+            upstream.record_failure(timeout=True)
+            return False
+        except Exception:
+            upstream.record_failure()
+            return False
+
+        if response.rcode() in FAILURE_RCODES:
+            upstream.record_failure()
+            return False
+
+        upstream.record_success(time.monotonic() - start)
+        return True
+
+    async def probe_all(self) -> None:
+        """Probe every upstream once"""
+        await asyncio.gather(*(self.probe(upstream) for upstream in self.upstreams))
+
+    def snapshot(self) -> Dict[str, List[float]]:
+        """RTT and failure rate averages of every upstream"""
+        return {upstream.name: [upstream.ewma_rtt, upstream.failure_rate] for upstream in self.upstreams}
+
+    def restore(self, data: Dict[str, List[float]]) -> int:
+        """Load averages saved by snapshot() for the upstreams still configured"""
+        restored = 0
+        for upstream in self.upstreams:
+            if upstream.name in data:
+                upstream.ewma_rtt, upstream.failure_rate = data[upstream.name]
+                restored += 1
+        return restored
+
+    def stats(self) -> Dict[str, Any]:
+        return {upstream.name: upstream.stats() for upstream in self.upstreams}
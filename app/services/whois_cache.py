@@ -0,0 +1,83 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class WhoisCacheEntry:
+    """A cached WHOIS result"""
+    __slots__ = ("raw_text", "parsed_data", "expires_at")
+
+    def __init__(self, raw_text: str, parsed_data: Dict[str, Any], expires_at: float):
+        self.raw_text = raw_text
+        self.parsed_data = parsed_data
+        self.expires_at = expires_at
+
+
+class WhoisCache:
+    """
+    Per-worker LRU cache of WHOIS results, keyed on the registrable domain
+
+    WHOIS data changes rarely, so entries live for WHOIS_CACHE_TTL and every
+    subdomain of a registered domain shares one entry.
+    """
+
+    def __init__(self, ttl: Optional[int] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl if ttl is not None else int(os.getenv("WHOIS_CACHE_TTL", 21600))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("WHOIS_CACHE_MAX_ENTRIES", 10000))
+        self._entries: "OrderedDict[str, WhoisCacheEntry]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key: str) -> Optional[WhoisCacheEntry]:
+        """Return a live entry for the key, or None on a miss"""
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, raw_text: str, parsed_data: Dict[str, Any], expires_at: Optional[float] = None) -> None:
+        """Store a result, evicting least recently used entries as needed"""
+        if not self.enabled:
+            return
+
+        self._entries[key] = WhoisCacheEntry(
+            raw_text,
+            parsed_data,
+            expires_at if expires_at is not None else time.time() + self.ttl
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def items(self) -> List[Tuple[str, WhoisCacheEntry]]:
+        """All entries, least recently used first"""
+        return list(self._entries.items())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cache counters"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
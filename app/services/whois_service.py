@@ -1,23 +1,102 @@
 from asyncwhois import aio_whois
+from asyncwhois.errors import NotFoundError
+from asyncwhois.parse_tld import DomainParser
+from asyncwhois.query import DomainQuery
+from tldextract import TLDExtract
 from loguru import logger
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime
+import asyncio
+import ipaddress
+import msgpack
+import os
+import re
+import time
+
+from app.services.single_flight import SingleFlight
+from app.services.l2_cache import RedisResultCache
+from app.services.metrics import WHOIS_IN_FLIGHT, WHOIS_QUERY_DURATION, observe
+from app.services.whois_cache import WhoisCache
+from app.services.rdap import RDAPClient
+from app.services.timing import phase
+from app.services.whois_throttle import WhoisThrottle, WhoisRefused
+
+
+# Public suffix list bundled with tldextract, so lookups never fetch it
+_tld_extract = TLDExtract(suffix_list_urls=())
+
+# Replies of WHOIS servers that throttle or refuse a client. Refusals are
+# short, so only the start of a reply is searched
+REFUSAL_SEARCH_LENGTH = 1024
+REFUSAL_PATTERN = re.compile(
+    r"limit exceeded|exceeded (the|your) .{0,30}limit|too many (requests|queries|connections)|"
+    r"quota exceeded|try again later|access denied",
+    re.IGNORECASE
+)
+
+
+def _pack_default(value: Any) -> Any:
+    """Encode values msgpack does not support natively"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _parse_domain(text: str, tld: str) -> Dict[str, Any]:
+    """Parse the authoritative WHOIS reply for a domain, runs in the parse pool"""
+    return DomainParser(ignore_not_found=False).parse(text, tld)
 
 
 class WhoisService:
-    async def lookup(self, domain: str, exclude_empty: bool = True) -> Dict[str, Any]:
+    def __init__(self):
+        # How long WHOIS results are cached
+        self.cache_ttl = int(os.getenv("WHOIS_CACHE_TTL", 21600))
+        # Timeout of a WHOIS query, per server in the referral chain
+        self.timeout = int(os.getenv("WHOIS_TIMEOUT", 10))
+        # Port 43 queries following referrals to the authoritative server
+        self.whois_query = DomainQuery(timeout=self.timeout)
+        # "host[:port]" receiving every port 43 query instead of the TLD's server, e.g. a local test server
+        self.server_override, _, port = os.getenv("WHOIS_SERVER", "").partition(":")
+        if port:
+            self.whois_query.whois_port = int(port)
+        # Processes parsing WHOIS text off the event loop, 0 parses on the loop
+        self.parse_workers = int(os.getenv("WHOIS_PARSE_WORKERS", 0))
+        self._parse_pool: Optional[ProcessPoolExecutor] = None
+        # In-process results, keyed on the registrable domain
+        self.cache = WhoisCache(self.cache_ttl)
+        # Results shared with other workers through Redis, msgpack encoded
+        self.l2_cache = RedisResultCache("whois")
+        # Identical lookups in flight share one WHOIS query
+        self.single_flight = SingleFlight()
+        # Concurrency and rate limits per WHOIS server
+        self.throttle = WhoisThrottle()
+        # "rdap" queries RDAP where the TLD has a server and port 43 elsewhere
+        self.backend = os.getenv("WHOIS_BACKEND", "whois").lower()
+        self.rdap = RDAPClient(self.throttle)
+    
+    async def lookup(
+        self,
+        domain: str,
+        exclude_empty: bool = True,
+        include_raw: bool = True
+    ) -> Dict[str, Any]:
         """
         Perform a WHOIS lookup for the given domain
         
         Args:
             domain: Domain to lookup
             exclude_empty: Whether to exclude fields with None values
+            include_raw: Whether to include the raw WHOIS text
         """
         try:
-            whois_data = await aio_whois(domain)
-            
-            # The response is a tuple, with raw text at index 0 and parsed data at index 1
-            raw_text = whois_data[0]
-            parsed_data = whois_data[1]
+            key = self._cache_key(domain)
+            entry = self.cache.get(key)
+            if entry is not None:
+                raw_text, parsed_data, cached = entry.raw_text, entry.parsed_data, True
+            else:
+                raw_text, parsed_data, cached = await self.single_flight.do(key, lambda: self._fetch(key))
             
             # Filter out empty values if requested
             if exclude_empty:
@@ -27,14 +106,17 @@ class WhoisService:
             whois_info = {
                 "domain": domain,
                 "registrar": parsed_data.get("registrar"),
-                "creation_date": parsed_data.get("creation_date"),
-                "expiration_date": parsed_data.get("expiration_date"),
+                "creation_date": parsed_data.get("creation_date", parsed_data.get("created")),
+                "expiration_date": parsed_data.get("expiration_date", parsed_data.get("expires")),
                 "name_servers": parsed_data.get("name_servers"),
                 "status": "success",
-                "raw_text": raw_text,
-                "parsed_data": parsed_data
+                "cached": cached
             }
             
+            if include_raw:
+                whois_info["raw_text"] = raw_text
+            whois_info["parsed_data"] = parsed_data
+            
             return whois_info
         except Exception as e:
             logger.error(f"WHOIS lookup error for {domain}: {str(e)}")
@@ -42,4 +124,140 @@ class WhoisService:
                 "domain": domain,
                 "status": "error",
                 "error": str(e)
-            } 
\ No newline at end of file
+            }
+    
+    @staticmethod
+    def _cache_key(domain: str) -> str:
+        """The registrable domain, so subdomains share one WHOIS result"""
+        domain = domain.strip().lower().rstrip(".")
+        parts = _tld_extract(domain)
+        return f"{parts.domain}.{parts.suffix}" if parts.domain and parts.suffix else domain
+    
+    async def _fetch(self, key: str) -> Tuple[str, Dict[str, Any], bool]:
+        """
+        Get WHOIS data through the shared cache or a live query and store it
+        Returns the raw text, the parsed data and whether it came from the cache
+        """
+        with phase("l2_cache"):
+            cached = await self.l2_cache.get(key)
+        if cached is not None:
+            try:
+                raw_text, parsed_data = msgpack.unpackb(cached[0])
+                self.cache.put(key, raw_text, parsed_data, time.time() + cached[1])
+                return raw_text, parsed_data, True
+            except Exception as e:
+                logger.error(f"Invalid WHOIS data in shared cache for {key}: {e}")
+        
+        raw_text, parsed_data = await self._query(key)
+        self.cache.put(key, raw_text, parsed_data)
+        self.l2_cache.set_behind(
+            key,
+            msgpack.packb([raw_text, parsed_data], default=_pack_default),
+            self.cache_ttl
+        )
+        return raw_text, parsed_data, False
+    
+    async def _query(self, domain: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Query WHOIS for the domain, returning the raw text and parsed data
+        Uses RDAP when enabled and the TLD has an RDAP server, port 43 otherwise.
+        """
+        if self.backend == "rdap" and "." in domain:
+            base_url = await self.rdap.server_for(domain.rsplit(".", 1)[1])
+            if base_url:
+                return await self.rdap.lookup(domain, base_url)
+        return await self._query_port43(domain)
+    
+    async def _query_port43(self, domain: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Query port 43 WHOIS for the domain
+        Waits for a turn at the domain's WHOIS server and backs off when it refuses.
+        The reply is parsed after the server's slot is released.
+        """
+        server = self.server_override or DomainQuery._get_server_name(domain)
+        throttle = self.throttle.server(server)
+        async with throttle.slot():
+            with phase("whois"), observe(WHOIS_QUERY_DURATION, WHOIS_IN_FLIGHT, throttle.server, "whois") as observation:
+                try:
+                    if self._is_ip(domain):
+                        raw_text, parsed_data = await aio_whois(domain, timeout=self.timeout)
+                        throttle.record_success()
+                        return raw_text, parsed_data
+                    chain = await self.whois_query.aio_run(domain, server)
+                except NotFoundError:
+                    observation.outcome = "not_found"
+                    throttle.record_success()
+                    raise
+                except (OSError, asyncio.TimeoutError):
+                    # Dropped or timed out connections are how most servers throttle
+                    throttle.record_refusal()
+                    raise
+                
+                if REFUSAL_PATTERN.search(chain[-1], 0, REFUSAL_SEARCH_LENGTH):
+                    observation.outcome = "refused"
+                    throttle.record_refusal()
+                    raise WhoisRefused(f"WHOIS server {throttle.server} refused the query, try again later")
+                throttle.record_success()
+        
+        # The whole referral chain is returned as raw text, the authoritative reply is parsed
+        parsed_data = await self._parse(chain[-1], domain.rsplit(".", 1)[-1])
+        return "\n".join(chain), parsed_data
+    
+    @staticmethod
+    def _is_ip(value: str) -> bool:
+        try:
+            ipaddress.ip_address(value)
+            return True
+        except ValueError:
+            return False
+    
+    async def _parse(self, text: str, tld: str) -> Dict[str, Any]:
+        """Parse a WHOIS reply in the parse pool, or on the loop when it is disabled"""
+        with phase("whois_parse"):
+            if self.parse_workers <= 0:
+                return _parse_domain(text, tld)
+            
+            if self._parse_pool is None:
+                self._parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._parse_pool, _parse_domain, text, tld)
+            except BrokenProcessPool:
+                # A worker died, start a new pool for the next lookup
+                self._parse_pool = None
+                raise
+    
+    def snapshot(self) -> List[List[Any]]:
+        """Cached results, for CacheSnapshot"""
+        now = time.time()
+        return [
+            [key, entry.raw_text, msgpack.packb(entry.parsed_data, default=_pack_default), entry.expires_at]
+            for key, entry in self.cache.items()
+            if entry.expires_at > now
+        ]
+    
+    def restore(self, data: List[List[Any]]) -> int:
+        """Load the unexpired results saved by snapshot()"""
+        now = time.time()
+        restored = 0
+        for key, raw_text, parsed_data, expires_at in data:
+            if expires_at > now:
+                self.cache.put(key, raw_text, msgpack.unpackb(parsed_data), expires_at)
+                restored += 1
+        return restored
+    
+    async def stop(self) -> None:
+        """Close pooled connections and parse processes"""
+        await self.rdap.close()
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown(wait=False, cancel_futures=True)
+            self._parse_pool = None
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return WHOIS service counters"""
+        return {
+            "cache": self.cache.stats(),
+            "l2_cache": self.l2_cache.stats(),
+            "single_flight": self.single_flight.stats(),
+            "servers": self.throttle.stats(),
+            "rdap": self.rdap.stats()
+        }
@@ -0,0 +1,140 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from app.services.timing import phase
+
+
+class WhoisServerBusy(Exception):
+    """Raised when too many lookups are already queued for a WHOIS server"""
+
+
+class WhoisRefused(Exception):
+    """Raised when a WHOIS server refuses or throttles a query"""
+
+
+class ServerThrottle:
+    """
+    Concurrency and rate limit for one WHOIS server
+
+    Lookups wait in line for one of `concurrency` slots and are started at
+    most `rate` per second. When the server refuses or drops a query the
+    next queries are held back for an exponentially growing backoff, which
+    shrinks again as queries succeed.
+    """
+
+    def __init__(
+        self,
+        server: str,
+        concurrency: int,
+        rate: float,
+        max_queue: int,
+        backoff_base: float,
+        backoff_max: float
+    ):
+        self.server = server
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.max_queue = max_queue
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._slots = asyncio.Semaphore(concurrency)
+        self._next_start = 0.0
+        self._blocked_until = 0.0
+
+        self.backoff = 0.0
+        self.queued = 0
+        self.active = 0
+        self.queries = 0
+        self.refusals = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Wait for a turn to query the server"""
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise WhoisServerBusy(f"Too many WHOIS lookups queued for {self.server}")
+
+        loop = asyncio.get_running_loop()
+        self.queued += 1
+        try:
+            with phase("whois_wait"):
+                await self._slots.acquire()
+                try:
+                    # Reserve the next start time so queued lookups are spaced out
+                    now = loop.time()
+                    start = max(now, self._next_start, self._blocked_until)
+                    self._next_start = start + self.interval
+                    if start > now:
+                        await asyncio.sleep(start - now)
+                except BaseException:
+                    self._slots.release()
+                    raise
+        finally:
+            self.queued -= 1
+
+        self.active += 1
+        self.queries += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+    def record_success(self) -> None:
+        self.backoff = self.backoff / 2 if self.backoff > self.backoff_base else 0.0
+
+    def record_refusal(self) -> None:
+        """Back off after the server refused, throttled or dropped a query"""
+        self.refusals += 1
+        self.backoff = min(self.backoff_max, self.backoff * 2 if self.backoff else self.backoff_base)
+        self._blocked_until = asyncio.get_running_loop().time() + self.backoff
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "active": self.active,
+            "backoff": round(self.backoff, 2),
+            "queries": self.queries,
+            "refusals": self.refusals,
+            "rejected": self.rejected,
+        }
+
+
+class WhoisThrottle:
+    """
+    Per-server throttles, created on first use with limits from the environment
+
+    WHOIS_SERVER_CONCURRENCY and WHOIS_SERVER_RATE bound the queries in
+    flight and started per second for each server, WHOIS_SERVER_MAX_QUEUE
+    the lookups waiting for it. Refusals back off from WHOIS_BACKOFF_BASE up
+    to WHOIS_BACKOFF_MAX seconds.
+    """
+
+    def __init__(self):
+        self.concurrency = int(os.getenv("WHOIS_SERVER_CONCURRENCY", 2))
+        self.rate = float(os.getenv("WHOIS_SERVER_RATE", 1))
+        self.max_queue = int(os.getenv("WHOIS_SERVER_MAX_QUEUE", 100))
+        self.backoff_base = float(os.getenv("WHOIS_BACKOFF_BASE", 1))
+        self.backoff_max = float(os.getenv("WHOIS_BACKOFF_MAX", 300))
+        self._servers: Dict[str, ServerThrottle] = {}
+
+    def server(self, name: Optional[str]) -> ServerThrottle:
+        name = name or "whois.iana.org"
+        throttle = self._servers.get(name)
+        if throttle is None:
+            throttle = ServerThrottle(
+                name,
+                self.concurrency,
+                self.rate,
+                self.max_queue,
+                self.backoff_base,
+                self.backoff_max
+            )
+            self._servers[name] = throttle
+        return throttle
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and counters per WHOIS server"""
+        return {name: throttle.stats() for name, throttle in self._servers.items()}
@@ -0,0 +1,216 @@
+"""
+Offline check of the upstream transports, RDAP parsing and rate limit leasing
+
+Runs the UDP, DoT and DoH transports against the stand-in servers and checks
+that truncated UDP answers are retried over TCP, that DoT pipelines
+concurrent queries over one connection and reconnects when the server
+closes it, and that DoH multiplexes concurrent queries over HTTP/2. WHOIS
+lookups over RDAP are checked to keep the registrar, dates and name servers,
+and leased rate limiting, against a redis-server of its own, to never deny
+a client well under its limit.
+
+    python -m benchmarks.check
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timezone
+from typing import Callable, List, Tuple
+
+import dns.flags
+import dns.message
+import dns.rdatatype
+
+from app.services.rate_limiter import ENGINES, LeasedRateLimiter
+from app.services.redis_pool import close_redis
+from app.services.transports import HTTPSTransport, StreamTransport, Transport, UDPTransport, tls_context
+from app.services.whois_service import WhoisService
+from benchmarks.fake_servers import (
+    NXDOMAIN_PREFIX,
+    TRUNCATE_PREFIX,
+    FakeDNSServer,
+    FakeDoHServer,
+    FakeRDAPServer,
+    expected_address,
+    self_signed_certificate,
+    server_ssl_context,
+)
+from benchmarks.run import start_redis
+
+
+HOSTNAME = "dns.bench.test"
+TIMEOUT = 5.0
+
+
+async def resolve(transport: Transport, name: str) -> dns.message.Message:
+    """Query the A record of the name and check the answer"""
+    response = await transport.query(dns.message.make_query(name, dns.rdatatype.A), TIMEOUT)
+    if response.flags & dns.flags.TC:
+        raise AssertionError(f"{name}: answer is truncated")
+    addresses = [rdata.address for rrset in response.answer for rdata in rrset]
+    if addresses != [expected_address(name)]:
+        raise AssertionError(f"{name}: answered {addresses}, expected {expected_address(name)}")
+    return response
+
+
+async def check_truncated_fallback(dns_server: FakeDNSServer) -> str:
+    transport = UDPTransport("127.0.0.1", dns_server.port)
+    before = dns_server.tcp_queries
+    try:
+        await resolve(transport, f"{TRUNCATE_PREFIX}fallback.bench.test")
+        await resolve(transport, "udp.bench.test")
+    finally:
+        await transport.close()
+    retried = dns_server.tcp_queries - before
+    assert retried == 1, f"{retried} queries retried over TCP, expected 1"
+    return "truncated answer retried over TCP"
+
+
+async def check_dot_pipelining(dns_server: FakeDNSServer) -> str:
+    transport = StreamTransport("127.0.0.1", dns_server.tls_port, tls_context(), HOSTNAME, pool_size=1)
+    try:
+        await asyncio.gather(*(resolve(transport, f"dot-{i}.bench.test") for i in range(20)))
+    finally:
+        await transport.close()
+    assert transport.connects == 1, f"{transport.connects} connections, expected 1"
+    assert dns_server.max_pipelined > 1, "queries were not pipelined"
+    return f"20 queries over 1 connection, up to {dns_server.max_pipelined} in flight"
+
+
+async def check_dot_reconnect(dns_server: FakeDNSServer) -> str:
+    transport = StreamTransport("127.0.0.1", dns_server.tls_port, tls_context(), HOSTNAME, pool_size=1)
+    try:
+        for i in range(12):
+            await resolve(transport, f"reconnect-{i}.bench.test")
+            # Lets the transport see the close before the next query
+            await asyncio.sleep(0.01)
+    finally:
+        await transport.close()
+    assert transport.connects == 3, f"{transport.connects} connections, expected 3"
+    return f"12 queries over {transport.connects} connections closed after {dns_server.close_after} answers"
+
+
+async def check_doh_multiplexing(doh_server: FakeDoHServer) -> str:
+    transport = HTTPSTransport(doh_server.url)
+    try:
+        # One query first so the rest share its HTTP/2 connection
+        await resolve(transport, "doh.bench.test")
+        await asyncio.gather(*(resolve(transport, f"doh-{i}.bench.test") for i in range(20)))
+    finally:
+        await transport.close()
+    assert doh_server.connections == 1, f"{doh_server.connections} connections, expected 1"
+    assert doh_server.max_streams > 1, "queries were not multiplexed"
+    return f"21 queries over 1 connection, up to {doh_server.max_streams} streams at once"
+
+
+async def check_rdap_parsing(rdap_server: FakeRDAPServer) -> str:
+    os.environ.update({
+        "WHOIS_BACKEND": "rdap",
+        "RDAP_BOOTSTRAP_URL": rdap_server.bootstrap_url,
+        "RDAP_BOOTSTRAP_FILE": "",
+    })
+    service = WhoisService()
+    try:
+        result = await service.lookup("rdap-check.com")
+        missing = await service.lookup(f"{NXDOMAIN_PREFIX}rdap-check.com")
+    finally:
+        await service.stop()
+
+    assert result["status"] == "success", f"lookup failed: {result.get('error')}"
+    expected = {
+        "registrar": "Benchmark Registrar, Inc.",
+        "creation_date": datetime(2001, 3, 14, 9, 26, 53, tzinfo=timezone.utc),
+        "expiration_date": datetime(2030, 3, 14, 9, 26, 53, tzinfo=timezone.utc),
+        "name_servers": ["ns1.bench.test", "ns2.bench.test"],
+    }
+    for field, value in expected.items():
+        assert result[field] == value, f"{field} is {result[field]!r}, expected {value!r}"
+    assert missing["status"] == "error", f"{NXDOMAIN_PREFIX} domain was found"
+    assert rdap_server.queries == 2, f"{rdap_server.queries} RDAP queries, expected 2"
+    return "registrar, creation and expiration dates and name servers parsed"
+
+
+async def check_rate_limit_leasing() -> str:
+    # Two workers with short leases; a client sending bursts of 4 requests
+    # between leases makes 40 requests, well under its limit of 100 a minute
+    limit = 100
+    try:
+        for algorithm, engine_class in ENGINES.items():
+            workers = [LeasedRateLimiter(engine_class(), 0.1, 0.2) for _ in range(2)]
+            key = f"check:leasing:{algorithm}:{os.getpid()}"
+            denied = 0
+            for burst in range(10):
+                for i in range(4):
+                    result = await workers[(burst + i) % 2].hit(key, limit)
+                    denied += not result.allowed
+                await asyncio.sleep(0.3)
+            for worker in workers:
+                await worker.stop()
+            assert denied == 0, f"{algorithm}: {denied} of 40 requests denied"
+            assert all(worker.refunded_tokens for worker in workers), f"{algorithm}: unused lease tokens were not refunded"
+    finally:
+        await close_redis()
+    return f"40 requests at a limit of {limit} all allowed with {', '.join(ENGINES)}"
+
+
+async def run_checks(redis_available: bool) -> bool:
+    with tempfile.TemporaryDirectory(prefix="dns-api-check-") as directory:
+        cert_path, key_path = self_signed_certificate(directory, HOSTNAME)
+        # Read by tls_context() when the transports are created
+        os.environ["DNS_TLS_CA_FILE"] = cert_path
+
+        dns_server = FakeDNSServer(latency=0.05)
+        await dns_server.start()
+        await dns_server.start_tls(server_ssl_context(cert_path, key_path))
+        closing_server = FakeDNSServer(close_after=5)
+        await closing_server.start()
+        await closing_server.start_tls(server_ssl_context(cert_path, key_path))
+        doh_server = FakeDoHServer(dns_server, server_ssl_context(cert_path, key_path, alpn="h2"))
+        await doh_server.start()
+        rdap_server = FakeRDAPServer()
+        await rdap_server.start()
+
+        checks: List[Tuple[str, Callable]] = [
+            ("udp truncated fallback", lambda: check_truncated_fallback(dns_server)),
+            ("dot pipelining", lambda: check_dot_pipelining(dns_server)),
+            ("dot reconnect", lambda: check_dot_reconnect(closing_server)),
+            ("doh multiplexing", lambda: check_doh_multiplexing(doh_server)),
+            ("rdap parsing", lambda: check_rdap_parsing(rdap_server)),
+        ]
+        if redis_available:
+            checks.append(("rate limit leasing", check_rate_limit_leasing))
+        else:
+            print("skip  rate limit leasing: redis-server was not found on PATH")
+        passed = True
+        try:
+            for name, check in checks:
+                try:
+                    print(f"ok    {name}: {await check()}")
+                except Exception as e:
+                    passed = False
+                    print(f"FAIL  {name}: {type(e).__name__}: {e}")
+        finally:
+            await rdap_server.stop()
+            await doh_server.stop()
+            await closing_server.stop()
+            await dns_server.stop()
+    return passed
+
+
+def main() -> None:
+    stop_redis = None
+    if shutil.which("redis-server") is not None:
+        host, port, stop_redis = start_redis("local")
+        os.environ.update({"REDIS_HOST": host, "REDIS_PORT": str(port)})
+    try:
+        passed = asyncio.run(run_checks(stop_redis is not None))
+    finally:
+        if stop_redis is not None:
+            stop_redis()
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,533 @@
+import asyncio
+import datetime
+import hashlib
+import ipaddress
+import json
+import os
+import ssl
+import struct
+import threading
+from typing import Dict, Optional, Tuple
+
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+import h2.config
+import h2.connection
+import h2.events
+import h2.exceptions
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+
+# Zone answered by the stand-in DNS server
+ZONE = dns.name.from_text("bench.test")
+
+# First labels making the stand-in DNS server answer NXDOMAIN, or answer
+# over UDP with the TC flag so the query is retried over TCP
+NXDOMAIN_PREFIX = "nx-"
+TRUNCATE_PREFIX = "tc-"
+
+
+def _digest(name: str) -> bytes:
+    return hashlib.blake2b(name.encode(), digest_size=16).digest()
+
+
+def expected_address(name: str) -> str:
+    """The A record the stand-in DNS server answers for a name"""
+    return str(ipaddress.IPv4Address(b"\x0a" + _digest(name.lower().rstrip("."))[:3]))
+
+
+def self_signed_certificate(directory: str, hostname: str = "dns.bench.test") -> Tuple[str, str]:
+    """
+    Write a self-signed certificate for the hostname and 127.0.0.1 to the
+    directory, returning the certificate and key paths
+    """
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, hostname)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .add_extension(
+            x509.SubjectAlternativeName([x509.DNSName(hostname), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]),
+            critical=False,
+        )
+        .sign(key, hashes.SHA256())
+    )
+
+    cert_path = os.path.join(directory, "standin.crt")
+    key_path = os.path.join(directory, "standin.key")
+    with open(cert_path, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ))
+    return cert_path, key_path
+
+
+def server_ssl_context(cert_path: str, key_path: str, alpn: Optional[str] = None) -> ssl.SSLContext:
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+    if alpn:
+        context.set_alpn_protocols([alpn])
+    return context
+
+
+class FakeDNSServer:
+    """
+    Authoritative stand-in for the upstream nameservers, over UDP, TCP and
+    optionally TLS (DoT)
+
+    Every name gets stable answers derived from its hash, each after `latency`
+    seconds with the given TTL. Names whose first label starts with "nx-" do
+    not exist; names starting with "tc-" are truncated over UDP. Stream
+    connections answer pipelined queries as each is ready and, with
+    `close_after`, are closed by the server after that many answers.
+    Counts the queries and connections it serves.
+    """
+
+    def __init__(self, latency: float = 0.0, ttl: int = 300, close_after: int = 0):
+        self.latency = latency
+        self.ttl = ttl
+        self.close_after = close_after
+        self.queries = 0
+        self.tcp_queries = 0
+        self.connections = 0
+        # Most queries in flight at once on one stream connection
+        self.max_pipelined = 0
+        self.port: Optional[int] = None
+        self.tls_port: Optional[int] = None
+        self._udp: Optional[asyncio.DatagramTransport] = None
+        self._tcp: Optional[asyncio.AbstractServer] = None
+        self._tls: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        loop = asyncio.get_running_loop()
+        self._tcp = await asyncio.start_server(self._serve_tcp, host, port)
+        self.port = self._tcp.sockets[0].getsockname()[1]
+        self._udp, _ = await loop.create_datagram_endpoint(
+            lambda: _DNSDatagramProtocol(self),
+            local_addr=(host, self.port)
+        )
+        return self.port
+
+    async def start_tls(self, ssl_context: ssl.SSLContext, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Also serve DNS over TLS, returning its port"""
+        self._tls = await asyncio.start_server(self._serve_tcp, host, port, ssl=ssl_context)
+        self.tls_port = self._tls.sockets[0].getsockname()[1]
+        return self.tls_port
+
+    async def stop(self) -> None:
+        if self._udp is not None:
+            self._udp.close()
+        for server in (self._tcp, self._tls):
+            if server is not None:
+                server.close()
+
+    def answer(self, wire: bytes, tcp: bool) -> bytes:
+        """Wire format reply to a wire format query"""
+        request = dns.message.from_wire(wire)
+        response = dns.message.make_response(request)
+        response.flags |= dns.flags.AA
+        self.queries += 1
+        if tcp:
+            self.tcp_queries += 1
+
+        question = request.question[0]
+        name = question.name.to_text(omit_final_dot=True).lower()
+        first_label = name.split(".", 1)[0]
+        if first_label.startswith(NXDOMAIN_PREFIX):
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            response.authority.append(self._soa())
+        elif first_label.startswith(TRUNCATE_PREFIX) and not tcp:
+            response.flags |= dns.flags.TC
+        else:
+            rrset = self._rrset(question.name, question.rdtype, name)
+            if rrset is None:
+                response.authority.append(self._soa())
+            else:
+                response.answer.append(rrset)
+        return response.to_wire()
+
+    def _rrset(self, qname: dns.name.Name, rdtype: int, name: str) -> Optional[dns.rrset.RRset]:
+        digest = _digest(name)
+        if rdtype == dns.rdatatype.A:
+            values = [expected_address(name)]
+        elif rdtype == dns.rdatatype.AAAA:
+            values = [str(ipaddress.IPv6Address(b"\xfd\x00" + digest[:14]))]
+        elif rdtype == dns.rdatatype.PTR:
+            values = [f"host-{digest[:4].hex()}.{ZONE}"]
+        elif rdtype == dns.rdatatype.MX:
+            values = [f"10 mx1.{ZONE}", f"20 mx2.{ZONE}"]
+        elif rdtype == dns.rdatatype.TXT:
+            values = [f'"v=spf1 include:{ZONE} -all"', f'"site-verification={digest.hex()}"']
+        elif rdtype == dns.rdatatype.NS:
+            values = [f"ns1.{ZONE}", f"ns2.{ZONE}"]
+        else:
+            return None
+        return dns.rrset.from_text(qname, self.ttl, "IN", rdtype, *values)
+
+    def _soa(self) -> dns.rrset.RRset:
+        return dns.rrset.from_text(
+            ZONE, self.ttl, "IN", dns.rdatatype.SOA,
+            f"ns1.{ZONE} hostmaster.{ZONE} 1 3600 600 86400 {self.ttl}"
+        )
+
+    async def _serve_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer pipelined queries on one connection, each as soon as it is ready"""
+        self.connections += 1
+        tasks = set()
+        state = {"answered": 0}
+        try:
+            while True:
+                length = struct.unpack("!H", await reader.readexactly(2))[0]
+                wire = await reader.readexactly(length)
+                task = asyncio.create_task(self._reply_tcp(wire, writer, state))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                self.max_pipelined = max(self.max_pipelined, len(tasks))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _reply_tcp(self, wire: bytes, writer: asyncio.StreamWriter, state: Dict[str, int]) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if writer.is_closing():
+            return
+        reply = self.answer(wire, tcp=True)
+        writer.write(struct.pack("!H", len(reply)) + reply)
+        state["answered"] += 1
+        if self.close_after and state["answered"] >= self.close_after:
+            writer.close()
+
+    def stats(self) -> dict:
+        return {
+            "queries": self.queries,
+            "tcp_queries": self.tcp_queries,
+            "connections": self.connections,
+            "max_pipelined": self.max_pipelined,
+        }
+
+
+class _DNSDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: FakeDNSServer):
+        self.server = server
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if self.server.latency:
+            asyncio.get_running_loop().call_later(self.server.latency, self._reply, data, addr)
+        else:
+            self._reply(data, addr)
+
+    def _reply(self, data: bytes, addr) -> None:
+        try:
+            self.transport.sendto(self.server.answer(data, tcp=False), addr)
+        except Exception:
+            pass
+
+
+class FakeDoHServer:
+    """
+    DNS over HTTPS stand-in speaking HTTP/2 over TLS, answering POSTed
+    application/dns-message queries on /dns-query like the given DNS server.
+    Counts connections and the most requests in flight on one of them.
+    """
+
+    PATH = "/dns-query"
+
+    def __init__(self, dns_server: FakeDNSServer, ssl_context: ssl.SSLContext):
+        self.dns_server = dns_server
+        self.ssl_context = ssl_context
+        self.requests = 0
+        self.connections = 0
+        # Most requests in flight at once on one connection
+        self.max_streams = 0
+        self.port: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(lambda: _DoHProtocol(self), host, port, ssl=self.ssl_context)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    @property
+    def url(self) -> str:
+        return f"https://127.0.0.1:{self.port}{self.PATH}"
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "connections": self.connections, "max_streams": self.max_streams}
+
+
+class _DoHProtocol(asyncio.Protocol):
+    def __init__(self, server: FakeDoHServer):
+        self.server = server
+        self.connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+        self.transport: Optional[asyncio.Transport] = None
+        # Stream ID -> (headers, body so far)
+        self.streams: Dict[int, Tuple[Dict[str, str], bytearray]] = {}
+        self.tasks = set()
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        self.server.connections += 1
+        self.connection.initiate_connection()
+        transport.write(self.connection.data_to_send())
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        for task in self.tasks:
+            task.cancel()
+
+    def data_received(self, data: bytes) -> None:
+        try:
+            events = self.connection.receive_data(data)
+        except h2.exceptions.ProtocolError:
+            self.transport.close()
+            return
+        for event in events:
+            if isinstance(event, h2.events.RequestReceived):
+                headers = {name.decode(): value.decode() for name, value in event.headers}
+                self.streams[event.stream_id] = (headers, bytearray())
+            elif isinstance(event, h2.events.DataReceived):
+                self.streams[event.stream_id][1].extend(event.data)
+                self.connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                task = asyncio.create_task(self._respond(event.stream_id))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+                self.server.max_streams = max(self.server.max_streams, len(self.tasks))
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                self.transport.close()
+        self.transport.write(self.connection.data_to_send())
+
+    async def _respond(self, stream_id: int) -> None:
+        headers, body = self.streams.pop(stream_id)
+        self.server.requests += 1
+        if headers.get(":method") != "POST" or headers.get(":path") != self.server.PATH:
+            self._send(stream_id, 404, b"")
+            return
+        if self.server.dns_server.latency:
+            await asyncio.sleep(self.server.dns_server.latency)
+        # Answered as over TCP: DoH responses are never truncated
+        self._send(stream_id, 200, self.server.dns_server.answer(bytes(body), tcp=True))
+
+    def _send(self, stream_id: int, status: int, body: bytes) -> None:
+        if self.transport.is_closing():
+            return
+        self.connection.send_headers(stream_id, [
+            (":status", str(status)),
+            ("content-type", "application/dns-message"),
+            ("content-length", str(len(body))),
+        ])
+        self.connection.send_data(stream_id, body, end_stream=True)
+        self.transport.write(self.connection.data_to_send())
+
+
+class FakeWhoisServer:
+    """
+    Port 43 WHOIS stand-in answering every domain with a registration record
+    in the format of the .com registry after `latency` seconds.
+    Domains whose first label starts with "nx-" are not found.
+    """
+
+    RECORD = (
+        "   Domain Name: {domain}\r\n"
+        "   Registry Domain ID: {digest}_DOMAIN_COM-VRSN\r\n"
+        "   Registrar URL: http://www.registrar.test\r\n"
+        "   Updated Date: 2024-05-01T10:00:00Z\r\n"
+        "   Creation Date: 2001-03-14T09:26:53Z\r\n"
+        "   Registry Expiry Date: 2030-03-14T09:26:53Z\r\n"
+        "   Registrar: Benchmark Registrar, Inc.\r\n"
+        "   Registrar IANA ID: 9999\r\n"
+        "   Registrar Abuse Contact Email: abuse@registrar.test\r\n"
+        "   Registrar Abuse Contact Phone: +1.5555550100\r\n"
+        "   Domain Status: clientTransferProhibited https://icann.org/epp#clientTransferProhibited\r\n"
+        "   Name Server: NS1.BENCH.TEST\r\n"
+        "   Name Server: NS2.BENCH.TEST\r\n"
+        "   DNSSEC: unsigned\r\n"
+        ">>> Last update of whois database: 2024-05-01T10:00:00Z <<<\r\n"
+    )
+    NOT_FOUND = 'No match for "{domain}".\r\n>>> Last update of whois database: 2024-05-01T10:00:00Z <<<\r\n'
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.queries = 0
+        self.port: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            domain = (await reader.readline()).decode(errors="ignore").strip().lower()
+            self.queries += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            template = self.NOT_FOUND if domain.startswith(NXDOMAIN_PREFIX) else self.RECORD
+            writer.write(template.format(domain=domain.upper(), digest=_digest(domain).hex()[:10]).encode())
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def stats(self) -> dict:
+        return {"queries": self.queries}
+
+
+class FakeRDAPServer:
+    """
+    RDAP stand-in over plain HTTP/1.1 with keep-alive, serving a bootstrap
+    registry at /dns.json that maps .com and .test to itself and the
+    registration of FakeWhoisServer as RDAP domain objects (RFC 9083) after
+    `latency` seconds. Domains whose first label starts with "nx-" are not found.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.queries = 0
+        self.port: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    @property
+    def bootstrap_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/dns.json"
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+
+    def domain(self, domain: str) -> dict:
+        """The RDAP domain object served for a domain"""
+        return {
+            "objectClassName": "domain",
+            "handle": f"{_digest(domain).hex()[:10].upper()}_DOMAIN_COM-VRSN",
+            "ldhName": domain.upper(),
+            "status": ["client transfer prohibited"],
+            "events": [
+                {"eventAction": "registration", "eventDate": "2001-03-14T09:26:53Z"},
+                {"eventAction": "expiration", "eventDate": "2030-03-14T09:26:53Z"},
+                {"eventAction": "last changed", "eventDate": "2024-05-01T10:00:00Z"},
+            ],
+            "entities": [{
+                "objectClassName": "entity",
+                "roles": ["registrar"],
+                "publicIds": [{"type": "IANA Registrar ID", "identifier": "9999"}],
+                "vcardArray": ["vcard", [["version", {}, "text", "4.0"], ["fn", {}, "text", "Benchmark Registrar, Inc."]]],
+                "entities": [{
+                    "objectClassName": "entity",
+                    "roles": ["abuse"],
+                    "vcardArray": ["vcard", [
+                        ["version", {}, "text", "4.0"],
+                        ["fn", {}, "text", "Abuse Contact"],
+                        ["tel", {"type": "voice"}, "uri", "tel:+1.5555550100"],
+                        ["email", {}, "text", "abuse@registrar.test"],
+                    ]],
+                }],
+            }],
+            "nameservers": [
+                {"objectClassName": "nameserver", "ldhName": "NS1.BENCH.TEST"},
+                {"objectClassName": "nameserver", "ldhName": "NS2.BENCH.TEST"},
+            ],
+            "secureDNS": {"delegationSigned": False},
+        }
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer GET requests on one connection until the client closes it"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()).strip():
+                    pass
+                status, body = await self._respond(request_line.decode(errors="ignore").split())
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    "Content-Type: application/rdap+json\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, request: list) -> Tuple[str, bytes]:
+        path = request[1] if len(request) == 3 and request[0] == "GET" else ""
+        if path == "/dns.json":
+            base_url = f"http://127.0.0.1:{self.port}/"
+            return "200 OK", json.dumps({"version": "1.0", "services": [[["com", "test"], [base_url]]]}).encode()
+        if not path.startswith("/domain/"):
+            return "404 Not Found", b'{"errorCode": 404, "title": "Not Found"}'
+
+        domain = path[len("/domain/"):].lower()
+        self.queries += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if domain.startswith(NXDOMAIN_PREFIX):
+            return "404 Not Found", b'{"errorCode": 404, "title": "Not Found"}'
+        return "200 OK", json.dumps(self.domain(domain)).encode()
+
+    def stats(self) -> dict:
+        return {"queries": self.queries}
+
+
+class ServerThread:
+    """Runs the stand-in servers on an event loop of their own, apart from the load generator"""
+
+    def __init__(self, dns_server: FakeDNSServer, whois_server: FakeWhoisServer):
+        self.dns_server = dns_server
+        self.whois_server = whois_server
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="fake-servers", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.dns_server.start(), self.loop).result()
+        asyncio.run_coroutine_threadsafe(self.whois_server.start(), self.loop).result()
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.dns_server.stop(), self.loop).result()
+        asyncio.run_coroutine_threadsafe(self.whois_server.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
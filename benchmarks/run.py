@@ -0,0 +1,420 @@
+"""
+Offline benchmark of the API
+
+Starts the application with uvicorn against a stand-in DNS server, a
+stand-in WHOIS server and a Redis server of its own without persistence
+(or the one given with --redis), drives each scenario at a fixed concurrency and
+reports throughput, latency percentiles, upstream query rates and memory
+per worker. Results are saved as JSON and can be compared with an earlier
+run with --compare.
+
+    python -m benchmarks.run --workers 2 --concurrency 64 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.fake_servers import (
+    NXDOMAIN_PREFIX,
+    TRUNCATE_PREFIX,
+    FakeDNSServer,
+    FakeWhoisServer,
+    ServerThread,
+)
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SCENARIOS = ("lookup", "reverse", "whois", "admin")
+ADMIN_SECRET = "benchmark-admin-secret"
+
+# A request: (path, query parameters, headers)
+Request = Tuple[str, Dict[str, Any], Dict[str, str]]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--concurrency", type=int, default=32, help="Requests in flight at any time")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds each scenario is measured")
+    parser.add_argument("--warmup", type=float, default=2, help="Seconds each scenario runs before it is measured")
+    parser.add_argument("--names", type=int, default=10000, help="Distinct names, addresses or domains queried, which sets the cache hit rate")
+    parser.add_argument("--record-types", default="A", help="Comma-separated record types of lookups, picked at random")
+    parser.add_argument("--nxdomain-rate", type=float, default=0.05, help="Fraction of names that do not exist")
+    parser.add_argument("--truncate-rate", type=float, default=0.01, help="Fraction of names answered truncated over UDP")
+    parser.add_argument("--dns-latency-ms", type=float, default=5, help="Latency of the stand-in DNS server")
+    parser.add_argument("--dns-ttl", type=int, default=300, help="TTL of the stand-in DNS server's answers")
+    parser.add_argument("--whois-latency-ms", type=float, default=50, help="Latency of the stand-in WHOIS server")
+    parser.add_argument("--redis", default="local", help='"local" to start redis-server without persistence, or "host:port" of a Redis server')
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="Environment variable of the application, may be repeated")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the request mix")
+    parser.add_argument("--output", help="Result file (default: benchmark-<time>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare with")
+    return parser.parse_args(argv)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_redis(spec: str) -> Tuple[str, int, Optional[Callable[[], None]]]:
+    """Address of the Redis server to use, and how to stop it when the harness started it"""
+    if spec != "local":
+        host, _, port = spec.rpartition(":")
+        return host or "127.0.0.1", int(port), None
+
+    binary = shutil.which("redis-server")
+    if binary is None:
+        sys.exit("redis-server was not found on PATH, install Redis or pass --redis host:port")
+    port = free_port()
+    process = subprocess.Popen(
+        [binary, "--bind", "127.0.0.1", "--port", str(port), "--save", "", "--appendonly", "no"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.STDOUT,
+    )
+
+    def stop() -> None:
+        process.terminate()
+        process.wait(timeout=10)
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return "127.0.0.1", port, stop
+        except OSError:
+            time.sleep(0.05)
+    stop()
+    sys.exit("redis-server did not start")
+
+
+def worker_pids(pid: int) -> List[int]:
+    """Processes serving requests: the uvicorn worker processes, or uvicorn itself with one worker"""
+    try:
+        children = Path(f"/proc/{pid}/task/{pid}/children").read_text().split()
+    except OSError:
+        return [pid]
+    workers = []
+    for child in children:
+        try:
+            cmdline = Path(f"/proc/{child}/cmdline").read_bytes()
+        except OSError:
+            continue
+        if b"resource_tracker" not in cmdline:
+            workers.append(int(child))
+    return workers or [pid]
+
+
+def memory(pid: int) -> Dict[str, Any]:
+    """Resident and peak resident memory of a process in MiB, from /proc"""
+    result: Dict[str, Any] = {"pid": pid}
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                result["rss_mb" if key == "VmRSS" else "peak_rss_mb"] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        pass
+    return result
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+class App:
+    """The application under test, run by uvicorn in a working directory of its own"""
+
+    def __init__(self, args: argparse.Namespace, env: Dict[str, str]):
+        self.args = args
+        self.env = env
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.workdir = tempfile.TemporaryDirectory(prefix="benchmark-")
+        self.output_path = Path(self.workdir.name) / "app.out"
+        self.process: Optional[subprocess.Popen] = None
+
+    def start(self) -> None:
+        env = {**os.environ, **self.env, "PYTHONPATH": str(REPO_ROOT)}
+        self.output = open(self.output_path, "wb")
+        self.process = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "app.main:app",
+                "--host", "127.0.0.1",
+                "--port", str(self.port),
+                "--workers", str(self.args.workers),
+                "--log-level", "warning",
+                "--no-access-log",
+            ],
+            cwd=self.workdir.name,
+            env=env,
+            stdout=self.output,
+            stderr=subprocess.STDOUT,
+        )
+
+    async def wait_ready(self, timeout: float = 60) -> None:
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(base_url=self.base_url) as client:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    break
+                try:
+                    if (await client.get("/ready")).status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.2)
+        tail = self.output_path.read_text(errors="replace")[-4000:]
+        raise RuntimeError(f"The application did not become ready:\n{tail}")
+
+    def memory(self) -> List[Dict[str, Any]]:
+        return [memory(pid) for pid in worker_pids(self.process.pid)]
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.output.close()
+        self.workdir.cleanup()
+
+
+class Workload:
+    """Request mix of every scenario, drawn from a seeded generator so runs are repeatable"""
+
+    def __init__(self, args: argparse.Namespace, credentials: Dict[str, str]):
+        self.args = args
+        self.credentials = credentials
+        self.admin = {"X-Admin-Secret": ADMIN_SECRET}
+        self.random = random.Random(args.seed)
+        self.record_types = [value.strip().upper() for value in args.record_types.split(",") if value.strip()]
+        self._admin_requests = [
+            ("/api/v1/admin/stats", {}),
+            ("/api/v1/admin/api-keys", {"limit": 100}),
+            ("/api/v1/admin/slow-requests", {}),
+        ]
+        self._admin_turn = 0
+
+    def _label(self, index: int) -> str:
+        """First label of name number `index`, with the prefix of its kind"""
+        # Spread the special names over the whole range with a fixed per-index draw
+        draw = random.Random(index).random()
+        if draw < self.args.nxdomain_rate:
+            return f"{NXDOMAIN_PREFIX}{index}"
+        if draw < self.args.nxdomain_rate + self.args.truncate_rate:
+            return f"{TRUNCATE_PREFIX}{index}"
+        return f"host-{index}"
+
+    def request(self, scenario: str) -> Request:
+        index = self.random.randrange(self.args.names)
+        if scenario == "lookup":
+            params = {"domain": f"{self._label(index)}.bench.test", "record_type": self.random.choice(self.record_types)}
+            return "/api/v1/dns/lookup", params, self.credentials
+        if scenario == "reverse":
+            ip = f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"
+            return "/api/v1/dns/reverse", {"ip": ip}, self.credentials
+        if scenario == "whois":
+            return "/api/v1/whois", {"domain": f"{self._label(index)}-bench.com"}, self.credentials
+        path, params = self._admin_requests[self._admin_turn % len(self._admin_requests)]
+        self._admin_turn += 1
+        return path, params, self.admin
+
+
+async def drive(client: httpx.AsyncClient, workload: Workload, scenario: str, concurrency: int, seconds: float) -> Dict[str, Any]:
+    """Keep `concurrency` requests of the scenario in flight for `seconds`"""
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    deadline = time.perf_counter() + seconds
+
+    async def user() -> None:
+        while time.perf_counter() < deadline:
+            path, params, headers = workload.request(scenario)
+            start = time.perf_counter()
+            try:
+                response = await client.get(path, params=params, headers=headers)
+                await response.aread()
+                statuses[str(response.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return {"latencies": latencies, "statuses": statuses, "elapsed": time.perf_counter() - start}
+
+
+def summarize(run: Dict[str, Any], dns_queries: int, whois_queries: int, workers: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ordered = sorted(run["latencies"])
+    elapsed = run["elapsed"]
+    statuses = run["statuses"]
+    ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+    return {
+        "requests": len(ordered),
+        "errors": len(ordered) - ok,
+        "statuses": dict(statuses),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(ordered) / elapsed, 1),
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+            "p50": round(percentile(ordered, 0.50) * 1000, 3),
+            "p95": round(percentile(ordered, 0.95) * 1000, 3),
+            "p99": round(percentile(ordered, 0.99) * 1000, 3),
+            "max": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        },
+        "upstream_dns_qps": round(dns_queries / elapsed, 1),
+        "upstream_whois_qps": round(whois_queries / elapsed, 1),
+        "workers": workers,
+    }
+
+
+async def run_scenarios(args: argparse.Namespace, app: App, dns_server: FakeDNSServer, whois_server: FakeWhoisServer) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=app.base_url, limits=limits, timeout=30) as client:
+        response = await client.post(
+            "/api/v1/admin/api-keys",
+            json={"name": "benchmark", "rate_limit": 10_000_000},
+            headers={"X-Admin-Secret": ADMIN_SECRET},
+        )
+        response.raise_for_status()
+        key = response.json()
+        workload = Workload(args, {"X-API-Key": key["api_key"], "X-API-Secret": key["api_secret"]})
+
+        results = {}
+        for scenario in [name.strip() for name in args.scenarios.split(",") if name.strip()]:
+            if scenario not in SCENARIOS:
+                raise SystemExit(f"Unknown scenario {scenario!r}, expected one of: {', '.join(SCENARIOS)}")
+            if args.warmup > 0:
+                await drive(client, workload, scenario, args.concurrency, args.warmup)
+            dns_before, whois_before = dns_server.queries, whois_server.queries
+            run = await drive(client, workload, scenario, args.concurrency, args.duration)
+            results[scenario] = summarize(
+                run,
+                dns_server.queries - dns_before,
+                whois_server.queries - whois_before,
+                app.memory(),
+            )
+            print_scenario(scenario, results[scenario])
+        return results
+
+
+def print_scenario(scenario: str, result: Dict[str, Any]) -> None:
+    latency = result["latency_ms"]
+    rss = sum(worker.get("rss_mb", 0) for worker in result["workers"])
+    print(
+        f"{scenario:<8} {result['requests_per_second']:>9.1f} req/s  "
+        f"p50 {latency['p50']:>8.2f} ms  p95 {latency['p95']:>8.2f} ms  p99 {latency['p99']:>8.2f} ms  "
+        f"errors {result['errors']:>6}  dns {result['upstream_dns_qps']:>8.1f} q/s  "
+        f"whois {result['upstream_whois_qps']:>7.1f} q/s  rss {rss:>7.1f} MiB"
+    )
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Print the change of throughput and latency against an earlier run"""
+    print(f"\nCompared with {baseline.get('started_at', 'the baseline')} ({baseline.get('git_commit') or 'unknown commit'}):")
+    for scenario, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(scenario)
+        if before is None:
+            continue
+        changes = [f"req/s {change(result['requests_per_second'], before['requests_per_second'])}"]
+        for key in ("p50", "p95", "p99"):
+            changes.append(f"{key} {change(result['latency_ms'][key], before['latency_ms'][key])}")
+        print(f"{scenario:<8} " + "  ".join(changes))
+
+
+def change(value: float, before: float) -> str:
+    if not before:
+        return "n/a"
+    return f"{(value - before) / before * 100:+.1f}%"
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    started_at = datetime.now(timezone.utc)
+
+    dns_server = FakeDNSServer(args.dns_latency_ms / 1000, args.dns_ttl)
+    whois_server = FakeWhoisServer(args.whois_latency_ms / 1000)
+    servers = ServerThread(dns_server, whois_server)
+    servers.start()
+    redis_host, redis_port, stop_redis = start_redis(args.redis)
+
+    env = {
+        "API_SECRET_KEY": ADMIN_SECRET,
+        "REDIS_HOST": redis_host,
+        "REDIS_PORT": str(redis_port),
+        "DNS_NAMESERVERS": f"127.0.0.1:{dns_server.port}",
+        "WHOIS_SERVER": f"127.0.0.1:{whois_server.port}",
+        # The stand-in WHOIS server does not need protecting from the benchmark
+        "WHOIS_SERVER_CONCURRENCY": "1000",
+        "WHOIS_SERVER_RATE": "1000000",
+        "WHOIS_SERVER_MAX_QUEUE": "100000",
+    }
+    for item in args.env:
+        name, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"--env expects NAME=VALUE, got {item!r}")
+        env[name] = value
+
+    app = App(args, env)
+    app.start()
+    try:
+        asyncio.run(app.wait_ready())
+        scenarios = asyncio.run(run_scenarios(args, app, dns_server, whois_server))
+    finally:
+        app.stop()
+        servers.stop()
+        if stop_redis is not None:
+            stop_redis()
+
+    result = {
+        "started_at": started_at.isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "app_env": env,
+        "scenarios": scenarios,
+    }
+    output = Path(args.output or f"benchmark-{started_at:%Y%m%d-%H%M%S}.json")
+    output.write_text(json.dumps(result, indent=2) + "\n")
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        compare(result, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == "__main__":
+    main()